@@ -0,0 +1,145 @@
+from compiler import Compiler
+from machine import Machine
+import argparse
+import json
+import os
+import sys
+import time
+
+# Runs the test programs with recorded inputs, checks what they print and compares the cycles they take and the size of
+# their code with a baseline, so that a change in the compiler that makes programs slower or bigger doesn't go
+# unnoticed.
+# The cases map the programs to lists of {"input": [...], "output": [...]}; the slow ones, which take the machine
+# minutes, are marked with "slow": true. The baseline maps "<program>#<number of the case>" to the cycles (i/o included)
+# and the size.
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+CASES_PATH = os.path.join(DIRECTORY, "benchmarks", "cases.json")
+BASELINE_PATH = os.path.join(DIRECTORY, "benchmarks", "baseline.json")
+# Bumped whenever the format of the baseline changes.
+BASELINE_VERSION = 1
+# Registers start with garbage in the machine, a fixed seed keeps the runs repeatable.
+SEED = 0
+
+
+def run_cases(cases, slow=False, max_steps=None, options=None):
+    # Compiles and runs the programs (relative to the directory of this file). Returns the results by the names of the
+    # cases: {"cycles", "size"} for the ones that printed what they should, {"error"} for the others.
+    compiler = Compiler(options)
+    results = {}
+    for program, runs in cases.items():
+        if not slow and all(run.get("slow") for run in runs):
+            continue
+        try:
+            with open(os.path.join(DIRECTORY, program)) as in_f:
+                machine = Machine(compiler.compile(in_f.read()), SEED)
+        except Exception as e:
+            for i, run in enumerate(runs):
+                results[f"{program}#{i}"] = {"error": f"compilation failed: {e}"}
+            continue
+        for i, run in enumerate(runs):
+            if run.get("slow") and not slow:
+                continue
+            machine.random.seed(SEED)
+            try:
+                result = machine.run(run["input"], max_steps)
+            except Exception as e:
+                results[f"{program}#{i}"] = {"error": str(e)}
+                continue
+            if result.output != run["output"]:
+                results[f"{program}#{i}"] = {"error": f"printed {result.output}, expected {run['output']}"}
+            else:
+                results[f"{program}#{i}"] = {"cycles": result.cost + result.io, "size": len(machine.program)}
+    return results
+
+
+def change(new, old):
+    return (new - old) / old if old else float(new > 0)
+
+
+def compare(results, baseline, threshold):
+    # Lines of the report and the number of cases that failed: printed something wrong or got slower or bigger than
+    # the baseline by more than the threshold (a fraction).
+    lines, failed = [], 0
+    totals = [0, 0, 0, 0]
+    for name, result in results.items():
+        if "error" in result:
+            lines.append(f"{name}: {result['error']}")
+            failed += 1
+            continue
+        old = baseline.get(name)
+        if old is None:
+            lines.append(f"{name}: {result['cycles']} cycles, {result['size']} instructions (not in the baseline)")
+            continue
+        cycles, size = change(result["cycles"], old["cycles"]), change(result["size"], old["size"])
+        regressed = cycles > threshold or size > threshold
+        failed += regressed
+        totals = [total + value for total, value in zip(totals, (result["cycles"], old["cycles"], result["size"],
+                                                                  old["size"]))]
+        lines.append(f"{name}: {result['cycles']} cycles ({cycles:+.2%}), {result['size']} instructions ({size:+.2%})"
+                     f"{' REGRESSION' if regressed else ''}")
+    lines.append(f"total: {totals[0]} cycles ({change(totals[0], totals[1]):+.2%}), {totals[2]} instructions "
+                 f"({change(totals[2], totals[3]):+.2%}) in the cases of the baseline")
+    return lines, failed
+
+
+def read_baseline(path):
+    with open(path) as in_f:
+        data = json.load(in_f)
+    if data.get("version") != BASELINE_VERSION:
+        raise Exception(f"Baseline {path} has version {data.get('version')}, expected {BASELINE_VERSION}")
+    return data["cases"]
+
+
+def write_baseline(path, results):
+    with open(path, "w") as out_f:
+        json.dump({"version": BASELINE_VERSION, "cases": results}, out_f, indent=1, sort_keys=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the test programs and compare their cycles and sizes with a "
+                                                 "baseline.")
+    parser.add_argument("programs", nargs="*", metavar="PATH",
+                        help="only run the programs in these files or directories (relative to the compiler)")
+    parser.add_argument("--cases", default=CASES_PATH, metavar="FILE", help="inputs and expected outputs")
+    parser.add_argument("--baseline", default=BASELINE_PATH, metavar="FILE", help="cycles and sizes to compare with")
+    parser.add_argument("--update", action="store_true",
+                        help="save the results as the baseline (keeping the cases that weren't run) instead")
+    parser.add_argument("--threshold", type=float, default=0.0, metavar="PERCENT",
+                        help="how much slower or bigger than the baseline a program may get, 0 by default")
+    parser.add_argument("--slow", action="store_true", help="run the slow cases too")
+    parser.add_argument("--max-steps", type=int, default=10 ** 9, help="abort a program after this many instructions")
+    args = parser.parse_args(argv)
+
+    with open(args.cases) as in_f:
+        cases = json.load(in_f)
+    if args.programs:
+        prefixes = [os.path.normpath(path) for path in args.programs]
+        cases = {program: runs for program, runs in cases.items()
+                 if any(program == prefix or program.startswith(prefix + os.sep) for prefix in prefixes)}
+    start = time.perf_counter()
+    results = run_cases(cases, args.slow, args.max_steps)
+    seconds = time.perf_counter() - start
+
+    if args.update:
+        errors = [name for name, result in results.items() if "error" in result]
+        for name in errors:
+            print(f"{name}: {results[name]['error']}", file=sys.stderr)
+        if errors:
+            return 1
+        baseline = read_baseline(args.baseline) if os.path.exists(args.baseline) else {}
+        baseline.update(results)
+        write_baseline(args.baseline, baseline)
+        print(f"Saved {len(results)} cases to {args.baseline} ({seconds:.1f} s)")
+        return 0
+
+    lines, failed = compare(results, read_baseline(args.baseline), args.threshold / 100)
+    for line in lines:
+        print(line)
+    print(f"{len(results)} cases, {failed} failed ({seconds:.1f} s)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.tracebacklimit = 0
+    sys.exit(main())
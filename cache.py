@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import tempfile
+
+# Compiled programs stored on disk under the hash of everything the output depends on: the source, the compiler and
+# the options. Any number of processes can share a cache: entries are written to a temporary file and renamed into
+# place, so a reader sees either a whole entry or none, and files that disappear because another process evicted
+# them are treated as misses.
+
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "imp-compiler")
+# Size the cache is kept under, in bytes. The least recently used entries go first.
+DEFAULT_LIMIT = 64 * 1024 * 1024
+
+compiler_hash = None
+
+
+def compiler_version():
+    # Hash of the compiler's own sources, so that any change to them makes the old entries unreachable.
+    global compiler_hash
+    if compiler_hash is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".py"):
+                with open(os.path.join(directory, name), "rb") as in_f:
+                    digest.update(name.encode() + b"\0" + in_f.read() + b"\0")
+        compiler_hash = digest.hexdigest()
+    return compiler_hash
+
+
+class Cache:
+    def __init__(self, directory=DEFAULT_DIR, limit=DEFAULT_LIMIT):
+        self.directory = directory
+        self.limit = limit
+
+    def key(self, text, options):
+        data = json.dumps([compiler_version(), text, options], sort_keys=True, default=str)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        # The stored entry or None. A hit marks the entry as recently used.
+        path = self.path(key)
+        try:
+            with open(path) as in_f:
+                entry = json.load(in_f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, key, entry):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".")
+        try:
+            with os.fdopen(handle, "w") as out_f:
+                json.dump(entry, out_f)
+            os.replace(temporary, path)
+        except OSError:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        self.evict()
+
+    def evict(self):
+        # Removes the least recently used entries until the cache fits in its limit.
+        entries, total = [], 0
+        for directory, _, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith("."):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
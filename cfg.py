@@ -0,0 +1,275 @@
+# Control-flow graph of a program, built from the syntax tree. The nodes keep the commands they come from (the same
+# tuples), so what an analysis finds out on the graph can be applied back to the tree, which the code generator works
+# on. Symbols are identified the same way as in the register allocator: names of variables and arrays,
+# ("undeclared", name) for iterators and ("counter", name) for the number of iterations left in a FOR loop.
+
+
+def value_keys(value, keys):
+    # The symbols a value, an expression or a condition reads.
+    if value[0] == "load":
+        identifier_keys(value[1], keys)
+    elif value[0] != "const":
+        for operand in value[1:]:
+            value_keys(operand, keys)
+    return keys
+
+
+def identifier_keys(ident, keys):
+    if type(ident) == str or ident[0] == "undeclared":
+        keys.add(ident)
+    else:
+        keys.add(ident[1])
+        if type(ident[2]) == tuple:
+            value_keys(ident[2], keys)
+    return keys
+
+
+def index_keys(ident):
+    # What writing to the identifier reads: the index of an array element.
+    if type(ident) == tuple and ident[0] == "array" and type(ident[2]) == tuple:
+        return value_keys(ident[2], set())
+    return set()
+
+
+def target_key(ident):
+    return ident[1] if type(ident) == tuple and ident[0] == "array" else ident
+
+
+class Node:
+    # uses are the symbols the node reads, kills the ones it overwrites as a whole and defines all the ones it writes,
+    # including the arrays it writes a single element of.
+    __slots__ = ("command", "uses", "kills", "defines")
+
+    def __init__(self, command, uses, kills, defines=None):
+        self.command = command
+        self.uses = uses
+        self.kills = kills
+        self.defines = kills if defines is None else defines
+
+
+class Assign(Node):
+    __slots__ = ()
+
+    def __init__(self, command):
+        target = command[1]
+        written = {target_key(target)} | set(command[3:])
+        kills = written if type(target) == str or target[0] == "undeclared" else set(command[3:])
+        super().__init__(command, value_keys(command[2], index_keys(target)), kills, written)
+
+
+class Read(Node):
+    __slots__ = ()
+
+    def __init__(self, command):
+        target = command[1]
+        kills = {target} if type(target) == str or target[0] == "undeclared" else set()
+        super().__init__(command, index_keys(target), kills, {target_key(target)})
+
+
+class Write(Node):
+    __slots__ = ()
+
+    def __init__(self, command):
+        super().__init__(command, value_keys(command[1], set()), set())
+
+
+class Test(Node):
+    # The condition of an if or a loop, the last node of its block; a FOR loop tests the number of iterations left.
+    __slots__ = ()
+
+    def __init__(self, command):
+        if command[0] in ("forup", "fordown"):
+            uses = {("counter", command[1])}
+        else:
+            uses = value_keys(command[1], set())
+        super().__init__(command, uses, set())
+
+
+class Enter(Node):
+    # Start of a FOR loop: sets the iterator and the number of iterations from the bounds.
+    __slots__ = ()
+
+    def __init__(self, command):
+        uses = value_keys(command[3], value_keys(command[2], set()))
+        super().__init__(command, uses, {("undeclared", command[1]), ("counter", command[1])})
+
+
+class Step(Node):
+    # End of an iteration of a FOR loop: moves the iterator and counts the iterations down.
+    __slots__ = ()
+
+    def __init__(self, command):
+        keys = {("undeclared", command[1]), ("counter", command[1])}
+        super().__init__(command, keys, keys)
+
+
+class Block:
+    __slots__ = ("number", "nodes", "successors", "predecessors")
+
+    def __init__(self, number):
+        self.number = number
+        self.nodes = []
+        self.successors = []
+        self.predecessors = []
+
+
+class Graph:
+    # blocks[0] is the entry and blocks[1] the exit of the program. idom maps the number of every block reachable from
+    # the entry to the number of its immediate dominator (the entry to itself).
+    def __init__(self, commands):
+        self.blocks = []
+        entry, end = self.new_block(), self.new_block()
+        self.link(self.build(commands, entry), end)
+        self.order = self.postorder()[::-1]
+        self.idom = self.dominators()
+
+    def new_block(self):
+        block = Block(len(self.blocks))
+        self.blocks.append(block)
+        return block
+
+    def link(self, source, target):
+        source.successors.append(target)
+        target.predecessors.append(source)
+
+    def build(self, commands, block):
+        # Adds the commands to the graph starting in the block, returns the block where they end.
+        for command in commands:
+            kind = command[0]
+            if kind == "assign":
+                block.nodes.append(Assign(command))
+            elif kind == "read":
+                block.nodes.append(Read(command))
+            elif kind == "write":
+                block.nodes.append(Write(command))
+            elif kind in ("if", "ifelse"):
+                block.nodes.append(Test(command))
+                after = self.new_block()
+                for branch in command[2:4] if kind == "ifelse" else command[2:3]:
+                    start = self.new_block()
+                    self.link(block, start)
+                    self.link(self.build(branch, start), after)
+                if kind == "if":
+                    self.link(block, after)
+                block = after
+            elif kind == "while":
+                head, body, after = self.new_block(), self.new_block(), self.new_block()
+                self.link(block, head)
+                head.nodes.append(Test(command))
+                self.link(head, body)
+                self.link(head, after)
+                self.link(self.build(command[2], body), head)
+                block = after
+            elif kind == "until":
+                body, after = self.new_block(), self.new_block()
+                self.link(block, body)
+                end = self.build(command[2], body)
+                end.nodes.append(Test(command))
+                self.link(end, body)
+                self.link(end, after)
+                block = after
+            else:
+                block.nodes.append(Enter(command))
+                head, body, after = self.new_block(), self.new_block(), self.new_block()
+                self.link(block, head)
+                head.nodes.append(Test(command))
+                self.link(head, body)
+                self.link(head, after)
+                end = self.build(command[4], body)
+                end.nodes.append(Step(command))
+                self.link(end, head)
+                block = after
+        return block
+
+    def postorder(self):
+        # Iterative, deep programs would exceed the recursion limit.
+        result, visited = [], {0}
+        stack = [(self.blocks[0], iter(self.blocks[0].successors))]
+        while stack:
+            block, successors = stack[-1]
+            successor = next((s for s in successors if s.number not in visited), None)
+            if successor is None:
+                result.append(block)
+                stack.pop()
+            else:
+                visited.add(successor.number)
+                stack.append((successor, iter(successor.successors)))
+        return result
+
+    def dominators(self):
+        # Cooper, Harvey and Kennedy: iterating in reverse postorder, which for the graphs of structured programs
+        # settles after a single pass.
+        position = {block.number: i for i, block in enumerate(self.order)}
+        idom = {0: 0}
+        changed = True
+        while changed:
+            changed = False
+            for block in self.order[1:]:
+                new = None
+                for predecessor in block.predecessors:
+                    if predecessor.number not in idom:
+                        continue
+                    if new is None:
+                        new = predecessor.number
+                        continue
+                    other = predecessor.number
+                    while new != other:
+                        while position[new] > position[other]:
+                            new = idom[new]
+                        while position[other] > position[new]:
+                            other = idom[other]
+                if idom.get(block.number) != new:
+                    idom[block.number] = new
+                    changed = True
+        return idom
+
+    def dominates(self, first, second):
+        # Whether every path from the entry to the block numbered second goes through the one numbered first.
+        while second != first and second != 0:
+            second = self.idom[second]
+        return second == first
+
+    def dominator_tree(self):
+        children = {number: [] for number in self.idom}
+        for number, parent in self.idom.items():
+            if number != parent:
+                children[parent].append(number)
+        return children
+
+    def loop(self, head):
+        # The blocks (by number) of the loop starting in the block numbered head: the ones that get back to it by an
+        # edge from a block it dominates without passing it first. None if no loop starts there.
+        back = [block.number for block in self.blocks[head].predecessors
+                if block.number in self.idom and self.dominates(head, block.number)]
+        if not back:
+            return None
+        blocks = {head}
+        while back:
+            number = back.pop()
+            if number not in blocks:
+                blocks.add(number)
+                back += [block.number for block in self.blocks[number].predecessors]
+        return blocks
+
+    def defines(self, numbers):
+        # The symbols the nodes of the blocks (by number) write.
+        return set().union(*(node.defines for number in numbers for node in self.blocks[number].nodes))
+
+    def liveness(self, ignored=()):
+        # The symbols live at the end of every block (by number): the ones some path from there reads before
+        # overwriting them. Nodes whose commands are in ignored (by id) are treated as if they weren't there.
+        live_out = {block.number: set() for block in self.blocks}
+        live_in = dict(live_out)
+        changed = True
+        while changed:
+            changed = False
+            for block in self.order[::-1]:
+                live = set().union(*(live_in[successor.number] for successor in block.successors))
+                live_out[block.number] = set(live)
+                for node in reversed(block.nodes):
+                    if id(node.command) not in ignored:
+                        live = live - node.kills | node.uses
+                if live != live_in[block.number]:
+                    live_in[block.number] = live
+                    changed = True
+        return live_out
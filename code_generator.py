@@ -1,19 +1,169 @@
 from symbol_table import Variable
+from instructions import GET, PUT, LOAD, STORE, ADD, SUB, RESET, INC, DEC, SHR, SHL, JUMP, JZERO, JODD, HALT, \
+    REGISTERS, REGISTER_NUMBERS, COSTS, CodeBuffer
+from constants import ConstantSynthesizer
+from register_allocator import RegisterAllocator
+
+# Constructs (see source_map.py) of the kinds of commands that don't have the same name.
+CONSTRUCTS = {"ifelse": "if", "forup": "for", "fordown": "for"}
+
+
+def simplify_condition(condition):
+    # True or False for the conditions that are decided without looking at the values, the condition otherwise.
+    if condition[1][0] == "const" and condition[2][0] == "const":
+        if condition[0] == "le":
+            return condition[1][1] <= condition[2][1]
+        elif condition[0] == "ge":
+            return condition[1][1] >= condition[2][1]
+        elif condition[0] == "lt":
+            return condition[1][1] < condition[2][1]
+        elif condition[0] == "gt":
+            return condition[1][1] > condition[2][1]
+        elif condition[0] == "eq":
+            return condition[1][1] == condition[2][1]
+        elif condition[0] == "ne":
+            return condition[1][1] != condition[2][1]
+
+    elif condition[1][0] == "const" and condition[1][1] == 0:
+        if condition[0] == "le":
+            return True
+        elif condition[0] == "gt":
+            return False
+        else:
+            return condition
+
+    elif condition[2][0] == "const" and condition[2][1] == 0:
+        if condition[0] == "ge":
+            return True
+        elif condition[0] == "lt":
+            return False
+        else:
+            return condition
+
+    elif condition[1] == condition[2]:
+        if condition[0] in ["ge", "le", "eq"]:
+            return True
+        else:
+            return False
+
+    else:
+        return condition
 
 
 class CodeGenerator:
     def __init__(self, commands, symbols):
         self.commands = commands
         self.symbols = symbols
-        self.code = []
+        self.code = CodeBuffer()
         self.iterators = []
+        # Smallest and largest values of the iterators of the loops we are in, for the ones with constant bounds.
+        self.bounds = {}
+        self.constants = ConstantSynthesizer()
+        self.allocator = RegisterAllocator(commands, symbols, self.constants)
+        # Values that registers (by number) are known to hold at the current point of the code, used to build
+        # constants and addresses from what's already there. Besides numbers these are expressions and ("load", ident)
+        # for variables and array elements, which stay valid until something they read is written (see forget). At
+        # a label only the values known on every path leading there are kept: jumps remember what they knew, which
+        # works as long as they all come before the label. Loop heads, where jumps come back from further on, forget
+        # everything.
+        self.known = {}
+        self.jumps = {}
+        self.loop_heads = set()
+        self.reachable = True
+        # Registers (letters) of the scalars that currently live in one (see RegisterAllocator for the keys), the keys
+        # whose values there are newer than in memory, and the numbers of these registers, which nothing else may
+        # overwrite - except for the one in writing, when a new value of its variable is being computed into it.
+        self.homes = {}
+        self.dirty = set()
+        self.locked = set()
+        self.writing = None
+        # Line of the source and construct (see source_map.py) the instructions emitted now come from, and the ones of
+        # every instruction emitted so far.
+        self.origin = (None, "consts")
+        self.origins = []
 
     def gen_code(self):
+        self.switch_homes(self.allocator.allocate(None, self.homes, self.dirty, self.iterators)[0])
+        # Constants printed by WRITE are stored once at the start, which is the only place that every WRITE comes
+        # after, no matter which branches run.
+        self.prepare_consts_before_block(sorted(self.written_consts(self.commands, set())))
         self.gen_code_from_commands(self.commands)
-        self.code.append("HALT")
+        self.origin = (None, "halt")
+        self.emit(HALT)
+        self.code.link()
+
+    def emit(self, op, reg=None, arg=None):
+        # Jumps take a label from new_label() as the argument, it gets resolved into a relative offset in gen_code.
+        self.append(op, REGISTER_NUMBERS[reg] if reg else 0, REGISTER_NUMBERS[arg] if type(arg) == str else arg or 0)
+
+    def append(self, op, reg, arg):
+        if reg in self.locked and reg != self.writing and op in (LOAD, ADD, SUB, RESET, INC, DEC, SHR, SHL):
+            raise Exception(f"Register {REGISTERS[reg]} holds a variable and can't be overwritten")
+        if op in (JUMP, JZERO, JODD):
+            if self.code.labels[arg] >= 0 and arg not in self.loop_heads:
+                raise Exception(f"Jump back to label {arg} which isn't a loop head")
+            self.jumps[arg] = self.common_values(self.jumps[arg], self.known) if arg in self.jumps else dict(self.known)
+        elif op == HALT:
+            self.reachable = False
+        if op == JUMP:
+            self.reachable = False
+        self.code.append(op, reg, arg)
+        self.origins.append(self.origin)
+        known = self.known
+        value = known.get(reg)
+        if op == RESET:
+            known[reg] = 0
+        elif op in (INC, DEC, SHL, SHR) and type(value) == int:
+            if op == INC:
+                known[reg] = value + 1
+            elif op == DEC:
+                known[reg] = max(value - 1, 0)
+            elif op == SHL:
+                known[reg] = value * 2
+            else:
+                known[reg] = value // 2
+        elif op in (ADD, SUB) and type(value) == int and type(known.get(arg)) == int:
+            known[reg] = value + known[arg] if op == ADD else max(value - known[arg], 0)
+        elif op in (ADD, SUB, LOAD, GET, INC, DEC, SHL, SHR):
+            known.pop(reg, None)
+
+    def new_label(self):
+        return self.code.label()
+
+    def new_labels(self, count):
+        return [self.code.label() for _ in range(count)]
+
+    def place(self, label, loop_head=False):
+        self.code.place(label)
+        if loop_head:
+            self.loop_heads.add(label)
+            self.known = {}
+        elif label in self.jumps:
+            jumped = self.jumps.pop(label)
+            self.known = self.common_values(jumped, self.known) if self.reachable else jumped
+        elif not self.reachable:
+            self.known = {}
+        self.reachable = True
+
+    def common_values(self, first, second):
+        return {reg: value for reg, value in first.items() if second.get(reg) == value}
+
+    def mark(self, construct):
+        # Attributes the instructions emitted from now on to the construct, returns the origin to go back to after it.
+        origin = self.origin
+        self.origin = (origin[0], construct)
+        return origin
 
     def gen_code_from_commands(self, commands):
+        outer = self.origin
         for command in commands:
+            # commands the passes made up without a line of their own belong to the one around them
+            line = self.symbols.lines.line(command)
+            self.origin = (outer[0] if line is None else line, CONSTRUCTS.get(command[0], command[0]))
+            spilled = []
+            if command[0] in ("assign", "read", "write"):
+                spilled = self.spill(self.allocator.demand(command, self.homes))
+
             if command[0] == "write":
                 value = command[1]
                 register = 'a'
@@ -22,12 +172,12 @@ class CodeGenerator:
                     if type(value[1]) == tuple:
                         if value[1][0] == "undeclared":
                             var = value[1][1]
-                            self.load_variable_address(var, register, declared=False)
+                            register = self.load_variable_address(var, register, declared=False)
                         elif value[1][0] == "array":
-                            self.load_array_address_at(value[1][1], value[1][2], register, register1)
+                            register = self.load_array_address_at(value[1][1], value[1][2], register, register1)
                     else:
                         if self.symbols[value[1]].initialized:
-                            self.load_variable_address(value[1], register)
+                            register = self.load_variable_address(value[1], register)
                         else:
                             raise Exception(f"Use of uninitialized variable {value[1]}")
 
@@ -37,10 +187,10 @@ class CodeGenerator:
                         address = self.symbols.add_const(value[1])
                         self.gen_const(address, register)
                         self.gen_const(value[1], register1)
-                        self.code.append(f"STORE {register1} {register}")
+                        self.emit(STORE, register1, register)
                     else:
-                        self.gen_const(address, register)
-                self.code.append(f"PUT {register}")
+                        register = self.register_with(address, register)
+                self.emit(PUT, register)
 
             elif command[0] == "read":
                 target = command[1]
@@ -53,11 +203,15 @@ class CodeGenerator:
                         else:
                             raise Exception(f"Reading to undeclared variable {target[1]}")
                     elif target[0] == "array":
-                        self.load_array_address_at(target[1], target[2], register, register1)
+                        register = self.load_array_address_at(target[1], target[2], register, register1)
                 else:
-                    self.load_variable_address(target, register)
+                    register = self.load_variable_address(target, register)
                     self.symbols[target].initialized = True
-                self.code.append(f"GET {register}")
+                self.emit(GET, register)
+                self.forget(target)
+                if target in self.homes:
+                    self.dirty.discard(target)
+                    self.load_home(target, register)
 
             elif command[0] == "assign":
                 target = command[1]
@@ -65,6 +219,16 @@ class CodeGenerator:
                 target_reg = 'a'
                 second_reg = 'b'
                 third_reg = 'c'
+                if len(command) > 3:
+                    self.assign_division(target, expression, command[3])
+                    self.restore(spilled)
+                    continue
+                if type(target) == str and target in self.homes:
+                    self.assign_home(target, expression)
+                    self.forget(target)
+                    self.symbols[target].initialized = True
+                    self.restore(spilled)
+                    continue
                 self.calculate_expression(expression)
                 if type(target) == tuple:
                     if target[0] == "undeclared":
@@ -73,190 +237,354 @@ class CodeGenerator:
                         else:
                             raise Exception(f"Assigning to undeclared variable {target[1]}")
                     elif target[0] == "array":
-                        self.load_array_address_at(target[1], target[2], second_reg, third_reg)
+                        second_reg = self.load_array_address_at(target[1], target[2], second_reg, third_reg)
                 else:
                     if type(self.symbols[target]) == Variable:
-                        self.load_variable_address(target, second_reg)
+                        second_reg = self.load_variable_address(target, second_reg)
                         self.symbols[target].initialized = True
                     else:
                         raise Exception(f"Assigning to array {target} with no index provided")
-                self.code.append(f"STORE {target_reg} {second_reg}")
+                self.emit(STORE, target_reg, second_reg)
+                self.forget(target)
+                self.known[REGISTER_NUMBERS[target_reg]] = ("load", target)
 
             elif command[0] == "if":
-                condition = self.simplify_condition(command[1])
+                condition = simplify_condition(command[1])
                 if isinstance(condition, bool):
                     if condition:
                         self.gen_code_from_commands(command[2])
                 else:
-                    self.prepare_consts_before_block(command[-1])
-                    condition_start = len(self.code)
-                    self.check_condition(condition)
-                    command_start = len(self.code)
+                    finish = self.new_label()
+                    self.check_condition(condition, finish)
+                    dirty = set(self.dirty)
                     self.gen_code_from_commands(command[2])
-                    command_end = len(self.code)
-                    for i in range(condition_start, command_start):
-                        self.code[i] = self.code[i].replace('finish', str(command_end - i))
+                    self.dirty |= dirty
+                    self.place(finish)
 
             elif command[0] == "ifelse":
-                condition = self.simplify_condition(command[1])
+                condition = simplify_condition(command[1])
                 if isinstance(condition, bool):
                     if condition:
                         self.gen_code_from_commands(command[2])
                     else:
                         self.gen_code_from_commands(command[3])
                 else:
-                    self.prepare_consts_before_block(command[-1])
-                    condition_start = len(self.code)
-                    self.check_condition(command[1])
-                    if_start = len(self.code)
+                    else_start, finish = self.new_labels(2)
+                    self.check_condition(command[1], else_start)
+                    dirty = set(self.dirty)
                     self.gen_code_from_commands(command[2])
-                    self.code.append(f"JUMP finish")
-                    else_start = len(self.code)
+                    self.emit(JUMP, arg=finish)
+                    self.place(else_start)
+                    dirty, self.dirty = self.dirty, dirty
                     self.gen_code_from_commands(command[3])
-                    command_end = len(self.code)
-                    self.code[else_start - 1] = self.code[else_start - 1].replace('finish',
-                                                                                  str(command_end - else_start + 1))
-                    for i in range(condition_start, if_start):
-                        self.code[i] = self.code[i].replace('finish', str(else_start - i))
+                    self.dirty |= dirty
+                    self.place(finish)
 
             elif command[0] == "while":
-                condition = self.simplify_condition(command[1])
+                condition = simplify_condition(command[1])
                 if isinstance(condition, bool):
                     if condition:
-                        self.prepare_consts_before_block(command[-1])
-                        loop_start = len(self.code)
+                        parent, written = self.enter_loop(command)
+                        loop_start = self.new_label()
+                        self.place(loop_start, loop_head=True)
+                        self.dirty |= written & self.homes.keys()
                         self.gen_code_from_commands(command[2])
-                        self.code.append(f"JUMP {loop_start - len(self.code)}")
+                        self.emit(JUMP, arg=loop_start)
+                        self.leave_loop(parent)
                 else:
-                    self.prepare_consts_before_block(command[-1])
-                    condition_start = len(self.code)
-                    self.check_condition(command[1])
-                    loop_start = len(self.code)
+                    parent, written = self.enter_loop(command)
+                    condition_start, loop_end = self.new_labels(2)
+                    self.place(condition_start, loop_head=True)
+                    self.dirty |= written & self.homes.keys()
+                    dirty = set(self.dirty)
+                    self.check_condition(command[1], loop_end)
                     self.gen_code_from_commands(command[2])
-                    self.code.append(f"JUMP {condition_start - len(self.code)}")
-                    loop_end = len(self.code)
-                    for i in range(condition_start, loop_start):
-                        self.code[i] = self.code[i].replace('finish', str(loop_end - i))
+                    self.emit(JUMP, arg=condition_start)
+                    self.place(loop_end)
+                    self.dirty |= dirty
+                    self.leave_loop(parent)
 
             elif command[0] == "until":
-                loop_start = len(self.code)
+                parent, written = self.enter_loop(command)
+                loop_start = self.new_label()
+                self.place(loop_start, loop_head=True)
+                self.dirty |= written & self.homes.keys()
+                dirty = set(self.dirty)
                 self.gen_code_from_commands(command[2])
-                condition_start = len(self.code)
-                self.check_condition(command[1])
-                condition_end = len(self.code)
-                for i in range(condition_start, condition_end):
-                    self.code[i] = self.code[i].replace('finish', str(loop_start - i))
+                self.check_condition(command[1], loop_start)
+                self.dirty |= dirty
+                self.leave_loop(parent)
 
-            elif command[0] == "forup":
+            elif command[0] in ("forup", "fordown"):
+                up = command[0] == "forup"
                 if command[2][0] == command[3][0] == "const":
-                    if command[2][1] > command[3][1]:
+                    if command[2][1] > command[3][1] if up else command[2][1] < command[3][1]:
                         continue
-                if self.iterators:
-                    address, bound_address = self.symbols.get_iterator(self.iterators[-1])
-                    self.gen_const(address, 'e')
-                    self.code.append(f"STORE f e")
-                else:
-                    self.prepare_consts_before_block(command[-1])
 
                 iterator = command[1]
-                address, bound_address = self.symbols.add_iterator(iterator)
-
-                self.calculate_expression(command[3], 'e')
-                self.code.append("INC e")
-                self.gen_const(bound_address, 'd')
-                self.code.append("STORE e d")
-
-                self.calculate_expression(command[2], 'f')
-                self.gen_const(address, 'd')
-                self.code.append("STORE f d")
-
-                self.iterators.append(iterator)
-
-                condition_start = len(self.code)
-                self.code.append("SUB e f")
-                self.code.append("JZERO e finish")
-
-                loop_start = len(self.code)
-                self.gen_code_from_commands(command[4])
-                self.code.append(f"INC f")
-                self.gen_const(bound_address, 'e')
-                self.code.append(f"LOAD e e")
-                self.code.append(f"JUMP {condition_start - len(self.code)}")
-                loop_end = len(self.code)
-
-                self.code[loop_start - 1] = f"JZERO e {loop_end - loop_start + 1}"
-
-                self.iterators.pop()
-                if self.iterators:
-                    address, bound_address = self.symbols.get_iterator(self.iterators[-1])
-                    self.gen_const(address, 'f')
-                    self.code.append(f"LOAD f f")
-
-            elif command[0] == "fordown":
-                if command[2][0] == command[3][0] == "const":
-                    if command[2][1] < command[3][1]:
-                        continue
-                if self.iterators:
-                    address, bound_address = self.symbols.get_iterator(self.iterators[-1])
-                    self.gen_const(address, 'e')
-                    self.code.append(f"STORE f e")
+                if iterator in self.iterators:
+                    raise Exception(f"Redeclaration of iterator {iterator}")
+                self.symbols.add_iterator(iterator)
+                key, counter = ("undeclared", iterator), ("counter", iterator)
+                parent, written = self.enter_loop(command)
+
+                # The loop counts down the number of iterations left, which is the only thing the condition needs.
+                first, last = command[2:4] if up else command[3:1:-1]
+                if first[0] == last[0] == "const":
+                    self.set_key(counter, last[1] + 1 - first[1], 'a', 'b')
+                    self.set_key(key, command[2][1], 'a', 'b')
+                elif up:
+                    start = self.operand(first, 'b', 'a')
+                    self.store_key(key, start, 'a')
+                    self.calculate_expression(last, 'a', 'c')
+                    self.emit(INC, 'a')
+                    self.emit(SUB, 'a', start)
+                    self.store_key(counter, 'a', 'b')
                 else:
-                    self.prepare_consts_before_block(command[-1])
-
-                iterator = command[1]
-                address, bound_address = self.symbols.add_iterator(iterator)
-
-                self.calculate_expression(command[3], 'e')
-                self.gen_const(bound_address, 'd')
-                self.code.append("STORE e d")
-
-                self.calculate_expression(command[2], 'f')
-                self.gen_const(address, 'd')
-                self.code.append("STORE f d")
+                    start = self.operand(last, 'b', 'a')
+                    self.store_key(key, start, 'a')
+                    self.emit(RESET, 'a')
+                    self.emit(ADD, 'a', start)
+                    self.emit(INC, 'a')
+                    self.emit(SUB, 'a', self.operand(first, 'b', 'c'))
+                    self.store_key(counter, 'a', 'b')
 
                 self.iterators.append(iterator)
+                if first[0] == last[0] == "const":
+                    self.bounds[iterator] = (first[1], last[1])
+                pointers = [pointer for pointer in self.homes if type(pointer) == tuple and pointer[0] == "pointer" and
+                            pointer[2] == iterator]
+                for pointer in pointers:
+                    self.point(pointer)
+
+                condition_start, loop_end = self.new_labels(2)
+                self.place(condition_start, loop_head=True)
+                self.dirty |= written & self.homes.keys()
+                dirty = set(self.dirty)
+                if counter in self.homes:
+                    self.emit(JZERO, self.homes[counter], loop_end)
+                else:
+                    self.load_key(counter, 'a')
+                    self.emit(JZERO, 'a', loop_end)
 
-                condition_start = len(self.code)
-                self.code.append("JZERO e loop_start")
-                self.code.append("RESET d")
-                self.code.append("ADD d f")
-                self.code.append("INC d")
-                self.code.append("SUB d e")
-                self.code.append("JZERO d finish")
-
-                loop_start = len(self.code)
                 self.gen_code_from_commands(command[4])
-                zero_jump = len(self.code)
-                self.code.append("JZERO f finish")
-                self.code.append(f"DEC f")
-                self.gen_const(bound_address, 'e')
-                self.code.append(f"LOAD e e")
-                self.code.append(f"JUMP {condition_start - len(self.code)}")
-                loop_end = len(self.code)
-
-                self.code[condition_start] = f"JZERO e {loop_start - condition_start}"
-                self.code[loop_start - 1] = f"JZERO d {loop_end - loop_start + 1}"
-                self.code[zero_jump] = f"JZERO f {loop_end - zero_jump}"
+                self.update_key(key, INC if up else DEC)
+                for pointer in pointers:
+                    if pointer in self.homes:
+                        self.writing = REGISTER_NUMBERS[self.homes[pointer]]
+                        self.emit(INC if up else DEC, self.homes[pointer])
+                        self.writing = None
+                self.update_key(counter, DEC)
+                self.emit(JUMP, arg=condition_start)
+                self.place(loop_end)
+                self.dirty |= dirty
 
                 self.iterators.pop()
-                if self.iterators:
-                    address, bound_address = self.symbols.get_iterator(self.iterators[-1])
-                    self.gen_const(address, 'f')
-                    self.code.append(f"LOAD f f")
+                self.bounds.pop(iterator, None)
+                self.leave_loop(parent, {key, counter})
+
+            self.restore(spilled)
+        self.origin = outer
+
+    def enter_loop(self, loop):
+        # Hands the registers over to the scalars that are hot in the loop. Returns what leave_loop needs to bring
+        # back the registers from before and the keys written in the loop, which are dirty whenever it jumps back.
+        parent = dict(self.homes)
+        homes, written = self.allocator.allocate(loop, self.homes, self.dirty, self.iterators)
+        origin = self.mark("registers")
+        self.switch_homes(homes)
+        self.origin = origin
+        return parent, written
+
+    def leave_loop(self, parent, dead=()):
+        origin = self.mark("registers")
+        self.switch_homes(parent, dead)
+        self.origin = origin
+
+    def switch_homes(self, homes, dead=()):
+        # Scalars that lose their register are stored unless their values are still in memory (or aren't needed
+        # anymore, which is the case for the dead keys), then the ones that get a register are loaded.
+        for key, reg in list(self.homes.items()):
+            if homes.get(key) != reg:
+                self.evict(key, key not in dead)
+        for key, reg in homes.items():
+            if key not in self.homes:
+                self.adopt(key, reg)
+
+    def evict(self, key, store=True):
+        reg = self.homes.pop(key)
+        self.locked.discard(REGISTER_NUMBERS[reg])
+        if key in self.dirty:
+            self.dirty.discard(key)
+            if store:
+                self.emit(STORE, reg, self.register_with(self.allocator.address(key), 'a'))
+
+    def adopt(self, key, reg):
+        # Values of variables that haven't been initialized yet don't have to be loaded.
+        self.homes[key] = reg
+        self.locked.add(REGISTER_NUMBERS[reg])
+        if not self.allocator.initialized(key, self.iterators):
+            return
+        elif key[0] == "pointer":
+            self.point(key)
+        else:
+            self.load_home(key, self.register_with(self.allocator.address(key), 'a'))
+
+    def point(self, key):
+        # Sets the register of a pointer to the address of the element at the current value of the iterator.
+        reg = self.homes[key]
+        self.writing = REGISTER_NUMBERS[reg]
+        self.load_array_address_at(key[1], ("load", ("undeclared", key[2])), reg, 'a')
+        self.writing = None
+
+    def spill(self, demand):
+        # Frees the registers a statement needs for its computations, returns the scalars that lived there.
+        spilled = [(key, reg) for key, reg in self.homes.items() if REGISTER_NUMBERS[reg] < demand]
+        origin = self.mark("registers")
+        for key, reg in spilled:
+            self.evict(key)
+        self.origin = origin
+        return spilled
+
+    def restore(self, spilled):
+        origin = self.mark("registers")
+        for key, reg in spilled:
+            self.adopt(key, reg)
+        self.origin = origin
+
+    def load_home(self, key, address_reg):
+        self.writing = REGISTER_NUMBERS[self.homes[key]]
+        self.emit(LOAD, self.homes[key], address_reg)
+        self.writing = None
+
+    def load_key(self, key, reg):
+        self.emit(LOAD, reg, self.register_with(self.allocator.address(key), reg))
+
+    def store_key(self, key, reg, address_reg):
+        # Sets the scalar to the value in reg.
+        self.forget(key)
+        if key in self.homes:
+            home = self.homes[key]
+            if home != reg:
+                self.writing = REGISTER_NUMBERS[home]
+                self.emit(RESET, home)
+                self.emit(ADD, home, reg)
+                self.writing = None
+            self.dirty.add(key)
+        else:
+            self.emit(STORE, reg, self.register_with(self.allocator.address(key), address_reg))
+
+    def set_key(self, key, const, reg, address_reg):
+        self.forget(key)
+        if key in self.homes:
+            self.writing = REGISTER_NUMBERS[self.homes[key]]
+            self.gen_const(const, self.homes[key])
+            self.writing = None
+            self.dirty.add(key)
+        else:
+            self.gen_const(const, reg)
+            self.store_key(key, reg, address_reg)
+
+    def update_key(self, key, op):
+        self.forget(key)
+        if key in self.homes:
+            self.writing = REGISTER_NUMBERS[self.homes[key]]
+            self.emit(op, self.homes[key])
+            self.writing = None
+            self.dirty.add(key)
+        else:
+            address_reg = self.register_with(self.allocator.address(key), 'a')
+            value_reg = 'a' if address_reg == 'b' else 'b'
+            self.emit(LOAD, value_reg, address_reg)
+            self.emit(op, value_reg)
+            self.emit(STORE, value_reg, address_reg)
+
+    def assign_home(self, target, expression):
+        home = self.homes[target]
+        this = ("load", target)
+        self.writing = REGISTER_NUMBERS[home]
+        if expression[0] in ("add", "sub") and this in expression[1:] and (expression[0] == "add" or
+                                                                           expression[1] == this):
+            # x := x + y and the like are done in place
+            if not self.symbols[target].initialized:
+                raise Exception(f"Use of uninitialized variable {target}")
+            other = expression[2] if expression[1] == this else expression[1]
+            if other[0] == "const" and self.cheaper_to_repeat(other[1]):
+                for _ in range(other[1]):
+                    self.emit(INC if expression[0] == "add" else DEC, home)
+            else:
+                self.emit(ADD if expression[0] == "add" else SUB, home, self.operand(other, 'a', 'b'))
+        elif not self.references(expression, target):
+            self.calculate_expression(expression, home, 'a', 'b', 'c', 'd')
+        else:
+            self.calculate_expression(expression)
+            self.emit(RESET, home)
+            self.emit(ADD, home, 'a')
+        self.writing = None
+        self.dirty.add(target)
+
+    def assign_division(self, target, expression, other):
+        # One division for both the target and the variable that keeps the other result (see fuse_divisions). It has
+        # to run even if some register still holds the quotient, since the remainder it leaves in b is needed too.
+        division = ("div",) + expression[1:]
+        origin = self.mark("div")
+        self.evaluate(division, 'a', 'b', 'c', 'd', 'e')
+        self.origin = origin
+        self.known[REGISTER_NUMBERS['a']] = division
+        results = {"div": 'a', "mod": 'b'}
+        self.store_key(other, results["mod" if expression[0] == "div" else "div"], 'c')
+        self.symbols[other].initialized = True
+        if type(target) == str:
+            self.store_key(target, results[expression[0]], 'c')
+            self.symbols[target].initialized = True
+        else:
+            self.emit(STORE, results[expression[0]], self.load_array_address_at(target[1], target[2], 'c', 'd'))
+            self.forget(target)
+
+    def references(self, expression, key):
+        if expression[0] == "const":
+            return False
+        elif expression[0] == "load":
+            ident = expression[1]
+            return ident == key or ident[0] == "array" and type(ident[2]) == tuple and ident[2][1] == key
+        return any(self.references(value, key) for value in expression[1:])
+
+    def operand(self, value, reg, spare):
+        # Returns a register holding the value, which may be the register of the variable - so it can only be read.
+        if value[0] == "load" and value[1] in self.homes:
+            if value[1][1] in self.iterators if type(value[1]) == tuple else self.symbols[value[1]].initialized:
+                return self.homes[value[1]]
+        self.calculate_expression(value, reg, spare)
+        return reg
 
     def gen_const(self, const, reg='a'):
-        self.code.append(f"RESET {reg}")
-        if const > 0:
-            bits = bin(const)[2:]
-            for bit in bits[:-1]:
-                if bit == '1':
-                    self.code.append(f"INC {reg}")
-                self.code.append(f"SHL {reg}")
-            if bits[-1] == '1':
-                self.code.append(f"INC {reg}")
+        numbers = {number: value for number, value in self.known.items() if type(value) == int}
+        for op, target, arg in self.constants.plan(const, REGISTER_NUMBERS[reg], numbers):
+            self.append(op, target, arg)
+
+    def cheaper_to_repeat(self, const):
+        # Whether INC/DEC repeated const times costs less than building the const in another register and adding it.
+        return const <= COSTS[RESET] + self.constants.cost(const) + COSTS[ADD]
 
     def calculate_expression(self, expression, target_reg='a', second_reg='b', third_reg='c', fourth_reg='d',
                              fifth_reg='e'):
+        # A value some register still holds is copied instead of being loaded or computed again.
+        if expression[0] != "const":
+            target = REGISTER_NUMBERS[target_reg]
+            held = next((number for number, value in sorted(self.known.items(), key=lambda item: item[0] != target)
+                         if value == expression), None)
+            if held is None:
+                origin = self.mark(expression[0]) if expression[0] in ("mul", "div", "mod") else self.origin
+                self.evaluate(expression, target_reg, second_reg, third_reg, fourth_reg, fifth_reg)
+                self.origin = origin
+            elif held != target:
+                self.emit(RESET, target_reg)
+                self.append(ADD, target, held)
+            self.known[target] = expression
+        else:
+            self.gen_const(expression[1], target_reg)
+
+    def evaluate(self, expression, target_reg, second_reg, third_reg, fourth_reg, fifth_reg):
         if expression[0] == "const":
             self.gen_const(expression[1], target_reg)
 
@@ -286,17 +614,16 @@ class CodeGenerator:
 
                 elif expression[1] == expression[2]:
                     self.calculate_expression(expression[1], target_reg, second_reg)
-                    self.code.append(f"SHL {target_reg}")
+                    self.emit(SHL, target_reg)
 
-                elif const and expression[const][1] < 12:
+                elif const and self.cheaper_to_repeat(expression[const][1]):
                     self.calculate_expression(expression[var], target_reg, second_reg)
-                    change = f"INC {target_reg}"
-                    self.code += expression[const][1] * [change]
+                    for _ in range(expression[const][1]):
+                        self.emit(INC, target_reg)
 
                 else:
                     self.calculate_expression(expression[1], target_reg, second_reg)
-                    self.calculate_expression(expression[2], second_reg, third_reg)
-                    self.code.append(f"ADD {target_reg} {second_reg}")
+                    self.emit(ADD, target_reg, self.operand(expression[2], second_reg, third_reg))
 
             elif expression[0] == "sub":
                 if expression[1][0] == expression[2][0] == "const":
@@ -304,23 +631,22 @@ class CodeGenerator:
                     if val:
                         self.gen_const(val, target_reg)
                     else:
-                        self.code.append(f"RESET {target_reg}")
+                        self.emit(RESET, target_reg)
 
                 elif expression[1] == expression[2]:
-                    self.code.append(f"RESET {target_reg}")
+                    self.emit(RESET, target_reg)
 
-                elif const and const == 2 and expression[const][1] < 12:
+                elif const and const == 2 and self.cheaper_to_repeat(expression[const][1]):
                     self.calculate_expression(expression[var], target_reg, second_reg)
-                    change = f"DEC {target_reg}"
-                    self.code += expression[const][1] * [change]
+                    for _ in range(expression[const][1]):
+                        self.emit(DEC, target_reg)
 
                 elif const and const == 1 and expression[const][1] == 0:
-                    self.code.append(f"RESET {target_reg}")
+                    self.emit(RESET, target_reg)
 
                 else:
                     self.calculate_expression(expression[1], target_reg, second_reg)
-                    self.calculate_expression(expression[2], second_reg, third_reg)
-                    self.code.append(f"SUB {target_reg} {second_reg}")
+                    self.emit(SUB, target_reg, self.operand(expression[2], second_reg, third_reg))
 
             elif expression[0] == "mul":
                 if expression[1][0] == expression[2][0] == "const":
@@ -330,7 +656,7 @@ class CodeGenerator:
                 if const:
                     val = expression[const][1]
                     if val == 0:
-                        self.code.append(f"RESET {target_reg}")
+                        self.emit(RESET, target_reg)
                         return
                     elif val == 1:
                         self.calculate_expression(expression[var], target_reg, second_reg)
@@ -338,68 +664,66 @@ class CodeGenerator:
                     elif val & (val - 1) == 0:
                         self.calculate_expression(expression[var], target_reg, second_reg)
                         while val > 1:
-                            self.code.append(f"SHL {target_reg}")
+                            self.emit(SHL, target_reg)
                             val /= 2
                         return
+                    elif self.constants.multiplication(val) is not None:
+                        multiplicand_reg = self.operand(expression[var], second_reg, third_reg)
+                        self.emit(RESET, target_reg)
+                        self.emit(ADD, target_reg, multiplicand_reg)
+                        for op in self.constants.multiplication(val):
+                            self.emit(op, target_reg, None if op == SHL else multiplicand_reg)
+                        return
 
                 if expression[1] == expression[2]:
                     self.calculate_expression(expression[1], second_reg, target_reg)
-                    self.code.append(f"RESET {third_reg}")
-                    self.code.append(f"ADD {third_reg} {second_reg}")
+                    self.emit(RESET, third_reg)
+                    self.emit(ADD, third_reg, second_reg)
                 else:
                     self.calculate_expression(expression[1], second_reg, target_reg)
                     self.calculate_expression(expression[2], third_reg, target_reg)
 
-                self.code.append(f"RESET {target_reg}")
-                self.code.append(f"JZERO {second_reg} 21")
-                self.code.append(f"JZERO {third_reg} 20")
-                self.code.append(f"ADD {target_reg} {second_reg}")
-                self.code.append(f"SUB {target_reg} {third_reg}")
-                self.code.append(f"JZERO {target_reg} 9")
+                finish, second_smaller = self.new_labels(2)
+                self.emit(RESET, target_reg)
+                self.emit(JZERO, second_reg, finish)
+                self.emit(JZERO, third_reg, finish)
+                self.emit(ADD, target_reg, second_reg)
+                self.emit(SUB, target_reg, third_reg)
+                self.emit(JZERO, target_reg, second_smaller)
 
                 # if second >= third it's better to do $2 * $3
-                self.code.append(f"RESET {target_reg}")
-                self.code.append(f"JZERO {third_reg} 15")
-                self.code.append(f"JODD {third_reg} 2")
-                self.code.append("JUMP 2")
-                self.code.append(f"ADD {target_reg} {second_reg}")
-                self.code.append(f"SHR {third_reg}")
-                self.code.append(f"SHL {second_reg}")
-                self.code.append("JUMP -6")
+                self.multiplication_loop(target_reg, second_reg, third_reg, finish)
 
                 # if second <= third it's better to do $3 * $2
-                self.code.append(f"RESET {target_reg}")
-                self.code.append(f"JZERO {second_reg} 7")
-                self.code.append(f"JODD {second_reg} 2")
-                self.code.append("JUMP 2")
-                self.code.append(f"ADD {target_reg} {third_reg}")
-                self.code.append(f"SHR {second_reg}")
-                self.code.append(f"SHL {third_reg}")
-                self.code.append("JUMP -6")
+                self.place(second_smaller)
+                self.multiplication_loop(target_reg, third_reg, second_reg, finish)
+                self.place(finish)
 
             elif expression[0] == "div":
                 if expression[1][0] == expression[2][0] == "const":
                     if expression[2][1] > 0:
                         self.gen_const(expression[1][1] // expression[2][1], target_reg)
                     else:
-                        self.code.append(f"RESET {target_reg}")
+                        self.emit(RESET, target_reg)
                     return
 
                 elif expression[1] == expression[2]:
                     self.calculate_expression(expression[1], third_reg, second_reg)
-                    self.code.append(f"RESET {target_reg}")
-                    self.code.append(f"JZERO {third_reg} 2")
-                    self.code.append(f"INC {target_reg}")
+                    finish = self.new_label()
+                    self.emit(RESET, target_reg)
+                    self.emit(JZERO, third_reg, finish)
+                    self.emit(INC, target_reg)
+                    self.place(finish)
                     return
 
                 elif const and const == 1 and expression[const][1] == 0:
-                    self.code.append(f"RESET {target_reg}")
+                    self.emit(RESET, target_reg)
                     return
 
                 elif const and const == 2:
                     val = expression[const][1]
                     if val == 0:
-                        self.code.append(f"RESET {target_reg}")
+                        self.emit(RESET, target_reg)
                         return
                     elif val == 1:
                         self.calculate_expression(expression[var], target_reg, second_reg)
@@ -407,239 +731,372 @@ class CodeGenerator:
                     elif val & (val - 1) == 0:
                         self.calculate_expression(expression[var], target_reg, second_reg)
                         while val > 1:
-                            self.code.append(f"SHR {target_reg}")
+                            self.emit(SHR, target_reg)
                             val /= 2
                         return
+                    else:
+                        self.calculate_expression(expression[1], second_reg, third_reg)
+                        self.divide_by_const(val, self.value_bounds(expression[1]), target_reg, second_reg,
+                                             third_reg, fourth_reg, fifth_reg)
+                        return
 
                 self.calculate_expression(expression[1], third_reg, second_reg)
-                self.calculate_expression(expression[2], fourth_reg, second_reg)
-                self.perform_division(target_reg, second_reg, third_reg, fourth_reg, fifth_reg)
+                divisor = self.operand(expression[2], fourth_reg, second_reg)
+                self.perform_division(target_reg, second_reg, third_reg, divisor, fifth_reg)
 
             elif expression[0] == "mod":
                 if expression[1][0] == expression[2][0] == "const":
                     if expression[2][1] > 0:
                         self.gen_const(expression[1][1] % expression[2][1], target_reg)
                     else:
-                        self.code.append(f"RESET {target_reg}")
+                        self.emit(RESET, target_reg)
                     return
 
                 elif expression[1] == expression[2]:
-                    self.code.append(f"RESET {target_reg}")
+                    self.emit(RESET, target_reg)
                     return
 
                 elif const and const == 1 and expression[const][1] == 0:
-                    self.code.append(f"RESET {target_reg}")
+                    self.emit(RESET, target_reg)
                     return
 
                 elif const and const == 2:
                     val = expression[const][1]
                     if val < 2:
-                        self.code.append(f"RESET {target_reg}")
+                        self.emit(RESET, target_reg)
                         return
                     elif val == 2:
                         self.calculate_expression(expression[var], second_reg, target_reg)
-                        self.code.append(f"RESET {target_reg}")
-                        self.code.append(f"JODD {second_reg} 2")
-                        self.code.append(f"JUMP 2")
-                        self.code.append(f"INC {target_reg}")
+                        odd, finish = self.new_labels(2)
+                        self.emit(RESET, target_reg)
+                        self.emit(JODD, second_reg, odd)
+                        self.emit(JUMP, arg=finish)
+                        self.place(odd)
+                        self.emit(INC, target_reg)
+                        self.place(finish)
+                        return
+                    elif val & (val - 1) == 0:
+                        # x % 2^k = x - (x >> k << k)
+                        self.calculate_expression(expression[var], target_reg, second_reg)
+                        self.emit(RESET, second_reg)
+                        self.emit(ADD, second_reg, target_reg)
+                        for op in (SHR, SHL):
+                            for _ in range(val.bit_length() - 1):
+                                self.emit(op, second_reg)
+                        self.emit(SUB, target_reg, second_reg)
+                        return
+                    else:
+                        self.calculate_expression(expression[1], target_reg, third_reg)
+                        self.divide_by_const(val, self.value_bounds(expression[1]), None, target_reg, third_reg,
+                                             fourth_reg, fifth_reg)
                         return
 
                 self.calculate_expression(expression[1], third_reg, second_reg)
-                self.calculate_expression(expression[2], fourth_reg, second_reg)
-                self.perform_division(second_reg, target_reg, third_reg, fourth_reg, fifth_reg)
+                divisor = self.operand(expression[2], fourth_reg, second_reg)
+                self.perform_division(second_reg, target_reg, third_reg, divisor, fifth_reg)
+
+    def multiplication_loop(self, target_reg, multiplicand_reg, multiplier_reg, finish):
+        loop_start, odd, shift = self.new_labels(3)
+        self.emit(RESET, target_reg)
+        self.place(loop_start, loop_head=True)
+        self.emit(JZERO, multiplier_reg, finish)
+        self.emit(JODD, multiplier_reg, odd)
+        self.emit(JUMP, arg=shift)
+        self.place(odd)
+        self.emit(ADD, target_reg, multiplicand_reg)
+        self.place(shift)
+        self.emit(SHR, multiplier_reg)
+        self.emit(SHL, multiplicand_reg)
+        self.emit(JUMP, arg=loop_start)
+
+    def value_bounds(self, value):
+        # The smallest and the largest value the value can have, None if these aren't known.
+        if value[0] == "const":
+            return value[1], value[1]
+        elif value[0] == "load" and type(value[1]) == tuple and value[1][0] == "undeclared":
+            bounds = self.bounds.get(value[1][1])
+            return None if bounds is None else (min(bounds), max(bounds))
+
+    def divide_by_const(self, divisor, bounds, quotient_reg, remainder_reg, mask_reg, temp_reg, count_reg):
+        # Divides the dividend in remainder_reg by a constant divisor (at least 3), leaving the remainder there and
+        # the quotient in quotient_reg, unless it's None. Every step compares the remainder with the divisor shifted
+        # left j times, which is done by subtracting the mask (divisor << j) - 1 - a result above zero means the
+        # divisor fits, and the new remainder is one less than the result. Shifting the mask right gives the mask of
+        # the next step. With the bounds of the dividend known the steps are unrolled, otherwise a loop first shifts
+        # the mask left until it's not below the dividend, counting the steps in count_reg.
+        if bounds is not None and bounds[0] // divisor == bounds[1] // divisor:
+            quotient = bounds[0] // divisor
+            if quotient:
+                self.emit(SUB, remainder_reg, self.register_with(quotient * divisor, mask_reg))
+            if quotient_reg is not None:
+                self.gen_const(quotient, quotient_reg)
+            return
+
+        if quotient_reg is not None:
+            self.emit(RESET, quotient_reg)
+        if bounds is not None:
+            steps = (bounds[1] // divisor).bit_length()
+            self.gen_const((divisor << steps - 1) - 1, mask_reg)
+            for step in range(steps):
+                if step:
+                    self.emit(SHR, mask_reg)
+                    if quotient_reg is not None:
+                        self.emit(SHL, quotient_reg)
+                skip = self.new_label()
+                self.subtract_mask(quotient_reg, remainder_reg, mask_reg, temp_reg, skip)
+                self.place(skip)
+            return
+
+        # The quotient has at most count bits when the dividend shifted right by count and by the bits of the
+        # divisor but its highest one is zero.
+        align, step, finish = self.new_labels(3)
+        self.emit(RESET, temp_reg)
+        self.emit(ADD, temp_reg, remainder_reg)
+        for _ in range(divisor.bit_length() - 1):
+            self.emit(SHR, temp_reg)
+        self.gen_const(divisor - 1, mask_reg)
+        self.emit(RESET, count_reg)
+        self.place(align, loop_head=True)
+        self.emit(JZERO, temp_reg, step)
+        self.emit(SHR, temp_reg)
+        self.emit(SHL, mask_reg)
+        self.emit(INC, mask_reg)
+        self.emit(INC, count_reg)
+        self.emit(JUMP, arg=align)
+        self.place(step, loop_head=True)
+        self.emit(JZERO, count_reg, finish)
+        self.emit(DEC, count_reg)
+        self.emit(SHR, mask_reg)
+        if quotient_reg is not None:
+            self.emit(SHL, quotient_reg)
+        self.subtract_mask(quotient_reg, remainder_reg, mask_reg, temp_reg, step)
+        self.emit(JUMP, arg=step)
+        self.place(finish)
+
+    def subtract_mask(self, quotient_reg, remainder_reg, mask_reg, temp_reg, skip):
+        self.emit(RESET, temp_reg)
+        self.emit(ADD, temp_reg, remainder_reg)
+        self.emit(SUB, temp_reg, mask_reg)
+        self.emit(JZERO, temp_reg, skip)
+        self.emit(RESET, remainder_reg)
+        self.emit(ADD, remainder_reg, temp_reg)
+        self.emit(DEC, remainder_reg)
+        if quotient_reg is not None:
+            self.emit(INC, quotient_reg)
 
     def perform_division(self, quotient_register='a', remainder_register='b', dividend_register='c',
                          divisor_register='d', temp_register='e'):
-        start = len(self.code)
-        self.code.append(f"RESET {quotient_register}")
-        self.code.append(f"RESET {remainder_register}")
-        self.code.append(f"JZERO {divisor_register} finish")
-        self.code.append(f"ADD {remainder_register} {dividend_register}")
-
-        self.code.append(f"RESET {dividend_register}")
-        self.code.append(f"ADD {dividend_register} {divisor_register}")
-        self.code.append(f"RESET {temp_register}")
-        self.code.append(f"ADD {temp_register} {remainder_register}")
-        self.code.append(f"SUB {temp_register} {dividend_register}")
-        self.code.append(f"JZERO {temp_register} block_start")
-        self.code.append(f"RESET {temp_register}")
-        self.code.append(f"ADD {temp_register} {dividend_register}")
-        self.code.append(f"SUB {temp_register} {remainder_register}")
-        self.code.append(f"JZERO {temp_register} 3")
-        self.code.append(f"SHR {dividend_register}")
-        self.code.append(f"JUMP 3")
-        self.code.append(f"SHL {dividend_register}")
-        self.code.append(f"JUMP -7")
-
-        block_start = len(self.code)
-        self.code.append(f"RESET {temp_register}")
-        self.code.append(f"ADD {temp_register} {dividend_register}")
-        self.code.append(f"SUB {temp_register} {remainder_register}")
-        self.code.append(f"JZERO {temp_register} 2")
-        self.code.append(f"JUMP finish")
-        self.code.append(f"SUB {remainder_register} {dividend_register}")
-        self.code.append(f"INC {quotient_register}")
-
-        midblock_start = len(self.code)
-        self.code.append(f"RESET {temp_register}")
-        self.code.append(f"ADD {temp_register} {dividend_register}")
-        self.code.append(f"SUB {temp_register} {remainder_register}")
-        self.code.append(f"JZERO {temp_register} block_start")
-        self.code.append(f"SHR {dividend_register}")
-        self.code.append(f"RESET {temp_register}")
-        self.code.append(f"ADD {temp_register} {divisor_register}")
-        self.code.append(f"SUB {temp_register} {dividend_register}")
-        self.code.append(f"JZERO {temp_register} 2")
-        self.code.append(f"JUMP finish")
-        self.code.append(f"SHL {quotient_register}")
-        self.code.append(f"JUMP midblock_start")
-        end = len(self.code)
-
-        for i in range(start, end):
-            self.code[i] = self.code[i].replace('midblock_start', str(midblock_start - i))
-            self.code[i] = self.code[i].replace('block_start', str(block_start - i))
-            self.code[i] = self.code[i].replace('finish', str(end - i))
-
-    def simplify_condition(self, condition):
-        if condition[1][0] == "const" and condition[2][0] == "const":
-            if condition[0] == "le":
-                return condition[1][1] <= condition[2][1]
-            elif condition[0] == "ge":
-                return condition[1][1] >= condition[2][1]
-            elif condition[0] == "lt":
-                return condition[1][1] < condition[2][1]
-            elif condition[0] == "gt":
-                return condition[1][1] > condition[2][1]
-            elif condition[0] == "eq":
-                return condition[1][1] == condition[2][1]
-            elif condition[0] == "ne":
-                return condition[1][1] != condition[2][1]
-
-        elif condition[1][0] == "const" and condition[1][1] == 0:
-            if condition[0] == "le":
-                return True
-            elif condition[0] == "gt":
-                return False
-            else:
-                return condition
-
-        elif condition[2][0] == "const" and condition[2][1] == 0:
-            if condition[0] == "ge":
-                return True
-            elif condition[0] == "lt":
-                return False
-            else:
-                return condition
-
-        elif condition[1] == condition[2]:
-            if condition[0] in ["ge", "le", "eq"]:
-                return True
-            else:
-                return False
-
-        else:
-            return condition
-
-    def check_condition(self, condition, first_reg='a', second_reg='b', third_reg='c'):
+        finish, block_start, midblock_start = self.new_labels(3)
+        align_start, align_shift, quotient_shift, subtract = self.new_labels(4)
+        self.emit(RESET, quotient_register)
+        self.emit(RESET, remainder_register)
+        self.emit(JZERO, divisor_register, finish)
+        self.emit(ADD, remainder_register, dividend_register)
+
+        self.emit(RESET, dividend_register)
+        self.emit(ADD, dividend_register, divisor_register)
+        self.emit(RESET, temp_register)
+        self.emit(ADD, temp_register, remainder_register)
+        self.emit(SUB, temp_register, dividend_register)
+        self.emit(JZERO, temp_register, block_start)
+        self.place(align_start, loop_head=True)
+        self.emit(RESET, temp_register)
+        self.emit(ADD, temp_register, dividend_register)
+        self.emit(SUB, temp_register, remainder_register)
+        self.emit(JZERO, temp_register, align_shift)
+        self.emit(SHR, dividend_register)
+        self.emit(JUMP, arg=block_start)
+        self.place(align_shift)
+        self.emit(SHL, dividend_register)
+        self.emit(JUMP, arg=align_start)
+
+        self.place(block_start, loop_head=True)
+        self.emit(RESET, temp_register)
+        self.emit(ADD, temp_register, dividend_register)
+        self.emit(SUB, temp_register, remainder_register)
+        self.emit(JZERO, temp_register, subtract)
+        self.emit(JUMP, arg=finish)
+        self.place(subtract)
+        self.emit(SUB, remainder_register, dividend_register)
+        self.emit(INC, quotient_register)
+
+        self.place(midblock_start, loop_head=True)
+        self.emit(RESET, temp_register)
+        self.emit(ADD, temp_register, dividend_register)
+        self.emit(SUB, temp_register, remainder_register)
+        self.emit(JZERO, temp_register, block_start)
+        self.emit(SHR, dividend_register)
+        self.emit(RESET, temp_register)
+        self.emit(ADD, temp_register, divisor_register)
+        self.emit(SUB, temp_register, dividend_register)
+        self.emit(JZERO, temp_register, quotient_shift)
+        self.emit(JUMP, arg=finish)
+        self.place(quotient_shift)
+        self.emit(SHL, quotient_register)
+        self.emit(JUMP, arg=midblock_start)
+        self.place(finish)
+
+    def check_condition(self, condition, finish, first_reg='a', second_reg='b', third_reg='c'):
+        # Jumps to the finish label if the condition is false and falls through otherwise.
+        origin = self.mark("condition")
         if condition[1][0] == "const" and condition[1][1] == 0:
             if condition[0] == "ge" or condition[0] == "eq":
-                self.calculate_expression(condition[2], first_reg, second_reg)
-                self.code.append(f"JZERO {first_reg} 2")
-                self.code.append("JUMP finish")
+                self.jump_unless_zero(self.operand(condition[2], first_reg, second_reg), finish)
 
             elif condition[0] == "lt" or condition[0] == "ne":
-                self.calculate_expression(condition[2], first_reg, second_reg)
-                self.code.append(f"JZERO {first_reg} finish")
+                self.emit(JZERO, self.operand(condition[2], first_reg, second_reg), finish)
 
         elif condition[2][0] == "const" and condition[2][1] == 0:
             if condition[0] == "le" or condition[0] == "eq":
-                self.calculate_expression(condition[1], first_reg, second_reg)
-                self.code.append(f"JZERO {first_reg} 2")
-                self.code.append("JUMP finish")
+                self.jump_unless_zero(self.operand(condition[1], first_reg, second_reg), finish)
 
             elif condition[0] == "gt" or condition[0] == "ne":
-                self.calculate_expression(condition[1], first_reg, second_reg)
-                self.code.append(f"JZERO {first_reg} finish")
+                self.emit(JZERO, self.operand(condition[1], first_reg, second_reg), finish)
 
         else:
-            self.calculate_expression(condition[1], first_reg, third_reg)
-            self.calculate_expression(condition[2], second_reg, third_reg)
+            # The operand that a comparison only subtracts may stay in the register of its variable.
+            if condition[0] in ("ge", "lt"):
+                first_reg = self.operand(condition[1], first_reg, third_reg)
+            else:
+                self.calculate_expression(condition[1], first_reg, third_reg)
+            if condition[0] in ("le", "gt"):
+                second_reg = self.operand(condition[2], second_reg, third_reg)
+            else:
+                self.calculate_expression(condition[2], second_reg, third_reg)
 
             if condition[0] == "le":
-                self.code.append(f"SUB {first_reg} {second_reg}")
-                self.code.append(f"JZERO {first_reg} 2")
-                self.code.append(f"JUMP finish")
+                self.emit(SUB, first_reg, second_reg)
+                self.jump_unless_zero(first_reg, finish)
 
             elif condition[0] == "ge":
-                self.code.append(f"SUB {second_reg} {first_reg}")
-                self.code.append(f"JZERO {second_reg} 2")
-                self.code.append(f"JUMP finish")
+                self.emit(SUB, second_reg, first_reg)
+                self.jump_unless_zero(second_reg, finish)
 
             elif condition[0] == "lt":
-                self.code.append(f"SUB {second_reg} {first_reg}")
-                self.code.append(f"JZERO {second_reg} finish")
+                self.emit(SUB, second_reg, first_reg)
+                self.emit(JZERO, second_reg, finish)
 
             elif condition[0] == "gt":
-                self.code.append(f"SUB {first_reg} {second_reg}")
-                self.code.append(f"JZERO {first_reg} finish")
+                self.emit(SUB, first_reg, second_reg)
+                self.emit(JZERO, first_reg, finish)
 
             elif condition[0] == "eq":
-                self.code.append(f"RESET {third_reg}")
-                self.code.append(f"ADD {third_reg} {first_reg}")
-                self.code.append(f"SUB {first_reg} {second_reg}")
-                self.code.append(f"JZERO {first_reg} 2")
-                self.code.append(f"JUMP finish")
-                self.code.append(f"SUB {second_reg} {third_reg}")
-                self.code.append(f"JZERO {second_reg} 2")
-                self.code.append(f"JUMP finish")
+                self.emit(RESET, third_reg)
+                self.emit(ADD, third_reg, first_reg)
+                self.emit(SUB, first_reg, second_reg)
+                self.jump_unless_zero(first_reg, finish)
+                self.emit(SUB, second_reg, third_reg)
+                self.jump_unless_zero(second_reg, finish)
 
             elif condition[0] == "ne":
-                self.code.append(f"RESET {third_reg}")
-                self.code.append(f"ADD {third_reg} {first_reg}")
-                self.code.append(f"SUB {first_reg} {second_reg}")
-                self.code.append(f"JZERO {first_reg} 2")
-                self.code.append(f"JUMP 3")
-                self.code.append(f"SUB {second_reg} {third_reg}")
-                self.code.append(f"JZERO {second_reg} finish")
+                second_check, not_equal = self.new_labels(2)
+                self.emit(RESET, third_reg)
+                self.emit(ADD, third_reg, first_reg)
+                self.emit(SUB, first_reg, second_reg)
+                self.emit(JZERO, first_reg, second_check)
+                self.emit(JUMP, arg=not_equal)
+                self.place(second_check)
+                self.emit(SUB, second_reg, third_reg)
+                self.emit(JZERO, second_reg, finish)
+                self.place(not_equal)
+        self.origin = origin
+
+    def jump_unless_zero(self, reg, label):
+        zero = self.new_label()
+        self.emit(JZERO, reg, zero)
+        self.emit(JUMP, arg=label)
+        self.place(zero)
+
+    def register_with(self, value, reg):
+        # Returns a register that already holds the value, or builds it in reg. The result may only be read.
+        for number, known in self.known.items():
+            if known == value:
+                return REGISTERS[number]
+        self.gen_const(value, reg)
+        return reg
+
+    def forget(self, ident):
+        # Called after writing a variable or an array element, drops the values of the registers that read it.
+        for number, value in list(self.known.items()):
+            if type(value) == tuple and self.depends(value, ident):
+                del self.known[number]
+
+    def depends(self, value, ident):
+        if value[0] == "load":
+            held = value[1]
+            if held == ident:
+                return True
+            elif type(held) == tuple and held[0] == "array":
+                if type(ident) == tuple and ident[0] == "array" and ident[1] == held[1]:
+                    # the same element or one we can't tell apart from it
+                    return type(ident[2]) != int or type(held[2]) != int or ident[2] == held[2]
+                return type(held[2]) == tuple and held[2][1] == ident
+            return False
+        return value[0] != "const" and any(self.depends(operand, ident) for operand in value[1:])
 
     def load_array_at(self, array, index, reg1, reg2):
-        self.load_array_address_at(array, index, reg1, reg2)
-        self.code.append(f"LOAD {reg1} {reg1}")
+        self.emit(LOAD, reg1, self.load_array_address_at(array, index, reg1, reg2))
 
     def load_array_address_at(self, array, index, reg1, reg2):
+        # Returns the register with the address, which is reg1 unless some register already holds it.
         if type(index) == int:
             address = self.symbols.get_address((array, index))
-            self.gen_const(address, reg1)
+            return self.register_with(address, reg1)
         elif type(index) == tuple:
-            if type(index[1]) == tuple:
-                self.load_variable(index[1][1], reg1, declared=False)
-            else:
-                if not self.symbols[index[1]].initialized:
-                    raise Exception(f"Trying to use {array}({index[1]}) where variable {index[1]} is uninitialized")
-                self.load_variable(index[1], reg1)
+            if type(index[1]) != tuple and not self.symbols[index[1]].initialized:
+                raise Exception(f"Trying to use {array}({index[1]}) where variable {index[1]} is uninitialized")
+            pointer = ("pointer", array, index[1][1]) if type(index[1]) == tuple else None
+            if pointer in self.homes and self.homes[pointer] != reg1:
+                # (unless it's the pointer's register that is being set)
+                return self.homes[pointer]
             var = self.symbols.get_variable(array)
-            self.gen_const(var.first_index, reg2)
-            self.code.append(f"SUB {reg1} {reg2}")
-            self.gen_const(var.memory_offset, reg2)
-            self.code.append(f"ADD {reg1} {reg2}")
+            # The address is the index moved by a single offset, the array's place in memory minus its first index.
+            offset = var.memory_offset - var.first_index
+            index_reg = self.operand(index, reg1, reg2)
+            if index_reg != reg1:
+                if offset >= 0:
+                    self.gen_const(offset, reg1)
+                    self.emit(ADD, reg1, index_reg)
+                    return reg1
+                self.emit(RESET, reg1)
+                self.emit(ADD, reg1, index_reg)
+            if offset and self.cheaper_to_repeat(abs(offset)):
+                for _ in range(abs(offset)):
+                    self.emit(INC if offset > 0 else DEC, reg1)
+            elif offset:
+                self.emit(ADD if offset > 0 else SUB, reg1, self.register_with(abs(offset), reg2))
+            return reg1
 
     def load_variable(self, name, reg, declared=True):
-        if not declared and self.iterators and name == self.iterators[-1]:
-            self.code.append(f"RESET {reg}")
-            self.code.append(f"ADD {reg} f")
+        key = name if declared else ("undeclared", name)
+        if key in self.homes and (declared or name in self.iterators):
+            self.emit(RESET, reg)
+            self.emit(ADD, reg, self.homes[key])
         else:
-            self.load_variable_address(name, reg, declared)
-            self.code.append(f"LOAD {reg} {reg}")
+            self.emit(LOAD, reg, self.load_variable_address(name, reg, declared))
 
     def load_variable_address(self, name, reg, declared=True):
+        # Returns the register with the address, which is reg unless some register already holds it.
         if declared or name in self.iterators:
-            address = self.symbols.get_address(name)
-            self.gen_const(address, reg)
-            if self.iterators and name == self.iterators[-1]:
-                self.code.append(f"STORE f {reg}")
+            key = name if declared else ("undeclared", name)
+            address_reg = self.register_with(self.allocator.address(key), reg)
+            if key in self.dirty:
+                # the address is used to access the variable in memory, so the value there has to be up to date
+                self.dirty.discard(key)
+                self.emit(STORE, self.homes[key], address_reg)
+            return address_reg
         else:
             raise Exception(f"Undeclared variable {name}")
 
+    def written_consts(self, commands, consts):
+        for command in commands:
+            if command[0] == "write" and command[1][0] == "const":
+                consts.add(command[1][1])
+            for block in command[2:5]:
+                if type(block) == list:
+                    self.written_consts(block, consts)
+        return consts
+
     def prepare_consts_before_block(self, consts, reg1='a', reg2='b'):
         for c in consts:
             address = self.symbols.get_const(c)
@@ -647,4 +1104,4 @@ class CodeGenerator:
                 address = self.symbols.add_const(c)
                 self.gen_const(address, reg1)
                 self.gen_const(c, reg2)
-                self.code.append(f"STORE {reg2} {reg1}")
+                self.emit(STORE, reg2, reg1)
@@ -1,7 +1,18 @@
 from sly import Lexer, Parser
 from symbol_table import SymbolTable, Array, Variable
 from code_generator import CodeGenerator
+from instructions import render
+import peephole
+import passes
+import layout
+import source_map
+import cache
+import parse_tables
+from concurrent.futures import ProcessPoolExecutor
+import argparse
 import sys
+import os
+import time
 
 
 class ImpLexer(Lexer):
@@ -64,13 +75,20 @@ class ImpLexer(Lexer):
 
 class ImpParser(Parser):
     tokens = ImpLexer.tokens
-    symbols = SymbolTable()
-    code = None
-    # We need a set of consts that will be written inside a loop/if. These need to be generated and stored pre-entry
-    # because the entry might not happen at all, for instance for [if 1 > 2 then write 1; endif write 1;] the code
-    # for storing 1 in memory would get generated inside the if and never be executed, causing the second write to
-    # print something undefined.
-    consts = set()
+
+    @classmethod
+    def _build(cls, definitions):
+        # SLY calls this when the class is created to build the parsing tables. They are loaded on the first parse
+        # instead, see parse_tables.py.
+        cls.definitions = definitions
+
+    def parse(self, tokens):
+        if not hasattr(type(self), "_lrtable"):
+            parse_tables.load(type(self), self.definitions)
+        # The symbol table is per compilation, so a single parser can be reused for many programs.
+        self.symbols = SymbolTable()
+        self.code = None
+        return super().parse(tokens)
 
     @_('DECLARE declarations BEGIN commands END', 'BEGIN commands END')
     def program(self, p):
@@ -91,10 +109,12 @@ class ImpParser(Parser):
 
     @_('commands command')
     def commands(self, p):
+        self.symbols.lines.record(p[1], self.line_position(p[1]))
         return p[0] + [p[1]]
 
     @_('command')
     def commands(self, p):
+        self.symbols.lines.record(p[0], self.line_position(p[0]))
         return [p[0]]
 
     @_('identifier GETS expression ";"')
@@ -103,21 +123,15 @@ class ImpParser(Parser):
 
     @_('IF condition THEN commands ELSE commands ENDIF')
     def command(self, p):
-        resp = "ifelse", p[1], p[3], p[5], self.consts.copy()
-        self.consts.clear()
-        return resp
+        return "ifelse", p[1], p[3], p[5]
 
     @_('IF condition THEN commands ENDIF')
     def command(self, p):
-        resp = "if", p[1], p[3], self.consts.copy()
-        self.consts.clear()
-        return resp
+        return "if", p[1], p[3]
 
     @_('WHILE condition DO commands ENDWHILE')
     def command(self, p):
-        resp = "while", p[1], p[3], self.consts.copy()
-        self.consts.clear()
-        return resp
+        return "while", p[1], p[3]
 
     @_('REPEAT commands UNTIL condition ";"')
     def command(self, p):
@@ -125,15 +139,11 @@ class ImpParser(Parser):
 
     @_('FOR PID FROM value TO value DO commands ENDFOR')
     def command(self, p):
-        resp = "forup", p[1], p[3], p[5], p[7], self.consts.copy()
-        self.consts.clear()
-        return resp
+        return "forup", p[1], p[3], p[5], p[7]
 
     @_('FOR PID FROM value DOWNTO value DO commands ENDFOR')
     def command(self, p):
-        resp = "fordown", p[1], p[3], p[5], p[7], self.consts.copy()
-        self.consts.clear()
-        return resp
+        return "fordown", p[1], p[3], p[5], p[7]
 
     @_('READ identifier ";"')
     def command(self, p):
@@ -141,8 +151,6 @@ class ImpParser(Parser):
 
     @_('WRITE value ";"')
     def command(self, p):
-        if p[1][0] == "const":
-            self.consts.add(int(p[1][1]))
         return "write", p[1]
 
     @_('value')
@@ -229,15 +237,216 @@ class ImpParser(Parser):
         raise Exception(f"Syntax error: '{token.value}' in line {token.lineno}")
 
 
-sys.tracebacklimit = 0
-lex = ImpLexer()
-pars = ImpParser()
-with open(sys.argv[1]) as in_f:
-    text = in_f.read()
-
-pars.parse(lex.tokenize(text))
-code_gen = pars.code
-code_gen.gen_code()
-with open(sys.argv[2], 'w') as out_f:
-    for line in code_gen.code:
-        print(line, file=out_f)
+# Options of a compilation, the values given to Compiler override these.
+# passes - names of the passes over the syntax tree to run (see passes.PASSES), None for all of them
+# unroll_budget - how many commands the copies of an unrolled loop body can have together, None for the default
+# peephole - names of the peephole rules to apply (see peephole.RULES), None for all of them
+# layout - addresses of the symbols as read by layout.read_json, None to lay the memory out anew
+# counts - numbers of accesses to the symbols (e.g. recorded by the machine) to lay the memory out by, None to estimate
+#          them from the program
+DEFAULT_OPTIONS = {
+    "passes": None,
+    "unroll_budget": None,
+    "peephole": None,
+    "layout": None,
+    "counts": None,
+}
+
+
+class Compiler:
+    def __init__(self, options=None, cache=None):
+        # cache is a cache.Cache for compile_file to look the programs up in and store them to, None for no caching.
+        self.lexer = ImpLexer()
+        self.parser = ImpParser()
+        self.options = dict(DEFAULT_OPTIONS, **(options or {}))
+        self.cache = cache
+        self.pass_times = {}
+        self.peephole_stats = {}
+        self.layout = None
+        self.source_map = None
+
+    def compile(self, text):
+        self.parser.parse(self.lexer.tokenize(text))
+        code_gen = self.parser.code
+        settings = {}
+        if self.options["unroll_budget"] is not None:
+            settings["unroll"] = {"budget": self.options["unroll_budget"]}
+        self.pass_times = passes.run(code_gen.commands, code_gen.symbols, self.options["passes"], settings)
+        if self.options["layout"] is not None:
+            code_gen.symbols.apply_layout(self.options["layout"])
+        else:
+            code_gen.symbols.lay_out(self.options["counts"] or layout.count_accesses(code_gen.commands))
+        code_gen.gen_code()
+        self.layout = dict(version=layout.LAYOUT_VERSION, **code_gen.symbols.addresses())
+        origins = list(code_gen.origins)
+        code, self.peephole_stats = peephole.optimize(code_gen.code, self.options["peephole"], origins)
+        self.source_map = source_map.ranges(origins)
+        return code
+
+    def compile_file(self, in_path, out_path, map_path=None):
+        # map_path, if given, is where to save the source map of the program (see source_map.py).
+        # Returns whether the output came from the cache, in which case there are no statistics of the compilation.
+        with open(in_path) as in_f:
+            text = in_f.read()
+        key = self.cache.key(text, self.options) if self.cache is not None else None
+        entry = self.cache.get(key) if key is not None else None
+        hit = entry is not None
+        if not hit:
+            code = self.compile(text)
+            entry = {"output": "".join(render(instruction) + "\n" for instruction in code), "layout": self.layout,
+                     "source_map": self.source_map}
+            if key is not None:
+                self.cache.put(key, entry)
+        self.layout, self.source_map = entry["layout"], entry["source_map"]
+        with open(out_path, 'w') as out_f:
+            out_f.write(entry["output"])
+        if map_path is not None:
+            source_map.write_json(map_path, in_path, self.source_map)
+        return hit
+
+
+def find_sources(paths):
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, files in sorted(os.walk(path)):
+                sources += [os.path.join(directory, f) for f in sorted(files) if f.endswith(".imp")]
+        else:
+            sources.append(path)
+    return sources
+
+
+def output_path(source, out_dir=None):
+    out_path = os.path.splitext(source)[0] + ".mr"
+    if out_dir is not None:
+        out_path = os.path.join(out_dir, os.path.basename(out_path))
+    return out_path
+
+
+# Compiler of the current process, set up once per worker so that every job reuses the same lexer and parser.
+worker_compiler = None
+
+
+def init_worker(options=None, cache_dir=None, cache_limit=cache.DEFAULT_LIMIT):
+    global worker_compiler
+    worker_compiler = Compiler(options, cache.Cache(cache_dir, cache_limit) if cache_dir is not None else None)
+
+
+def compile_job(source, out_path):
+    start = time.perf_counter()
+    try:
+        worker_compiler.compile_file(source, out_path)
+        error = None
+    except Exception as e:
+        out_path, error = None, str(e)
+    return source, out_path, error, time.perf_counter() - start
+
+
+def compile_many(paths, out_dir=None, jobs=1, options=None, cache_dir=None, cache_limit=cache.DEFAULT_LIMIT):
+    # Compiles every given file (or every .imp file inside the given directories) reusing the lexer and the parser.
+    # With jobs > 1 the files are spread over a pool of processes, which can share a cache in cache_dir. Returns a
+    # list of (source, output, error, seconds) in the order of the sources; a failing program doesn't stop the others
+    # from compiling.
+    sources = find_sources(paths)
+    out_paths = [output_path(source, out_dir) for source in sources]
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+    if jobs == 1 or len(sources) < 2:
+        init_worker(options, cache_dir, cache_limit)
+        return [compile_job(source, out_path) for source, out_path in zip(sources, out_paths)]
+    with ProcessPoolExecutor(jobs or None, initializer=init_worker,
+                             initargs=(options, cache_dir, cache_limit)) as executor:
+        return list(executor.map(compile_job, sources, out_paths))
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Compile programs in the imperative language to machine code.")
+    arg_parser.add_argument("input", nargs="?", help="input file")
+    arg_parser.add_argument("output", nargs="?", help="output file")
+    arg_parser.add_argument("-m", "--many", nargs="+", metavar="PATH",
+                            help="compile all the given files and .imp files inside the given directories")
+    arg_parser.add_argument("-d", "--out-dir",
+                            help="directory for the output of --many, next to the sources if not given")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=1,
+                            help="number of processes compiling the files given to --many, 0 to use all processors")
+    arg_parser.add_argument("--passes", metavar="PASSES",
+                            help=f"comma separated passes over the syntax tree to run, all by default "
+                                 f"({', '.join(passes.PASSES)})")
+    arg_parser.add_argument("--no-passes", action="store_true", help="don't run any passes over the syntax tree")
+    arg_parser.add_argument("--disable-pass", action="append", default=[], metavar="PASS",
+                            help="don't run the given pass, can be repeated")
+    arg_parser.add_argument("--unroll-budget", type=int, metavar="COMMANDS",
+                            help="how many commands the copies of an unrolled FOR loop body can have together")
+    arg_parser.add_argument("--pass-times", action="store_true", help="print the time every pass took")
+    arg_parser.add_argument("--peephole", metavar="RULES",
+                            help=f"comma separated peephole rules to apply, all by default "
+                                 f"({', '.join(peephole.RULES)})")
+    arg_parser.add_argument("--no-peephole", action="store_true", help="don't run the peephole optimizer")
+    arg_parser.add_argument("--peephole-stats", action="store_true",
+                            help="print the instructions and cycles saved by every peephole rule")
+    arg_parser.add_argument("--layout", metavar="FILE", help="place the symbols at the addresses from a layout file")
+    arg_parser.add_argument("--counts", metavar="FILE",
+                            help="lay the memory out by the numbers of accesses recorded by the machine")
+    arg_parser.add_argument("--dump-layout", metavar="FILE", help="save the addresses of the symbols to a layout file")
+    arg_parser.add_argument("--source-map", metavar="FILE",
+                            help="save the line and the construct every instruction comes from, for machine --profile")
+    arg_parser.add_argument("--cache", nargs="?", const=cache.DEFAULT_DIR, metavar="DIR",
+                            help=f"reuse the outputs of earlier compilations kept in a directory ({cache.DEFAULT_DIR} "
+                                 f"if not given); statistics are only printed when compiling anew")
+    arg_parser.add_argument("--cache-limit", type=int, default=cache.DEFAULT_LIMIT // 2 ** 20, metavar="MB",
+                            help="size of the cache, the least recently used outputs are removed above it")
+    args = arg_parser.parse_args(argv)
+
+    options = {}
+    if args.no_passes:
+        options["passes"] = []
+    elif args.passes is not None or args.disable_pass:
+        names = list(passes.PASSES) if args.passes is None else [name for name in args.passes.split(",") if name]
+        for name in args.disable_pass:
+            if name not in passes.PASSES:
+                arg_parser.error(f"unknown pass {name}")
+        options["passes"] = [name for name in names if name not in args.disable_pass]
+    if args.unroll_budget is not None:
+        options["unroll_budget"] = args.unroll_budget
+    if args.no_peephole:
+        options["peephole"] = []
+    elif args.peephole is not None:
+        options["peephole"] = [rule for rule in args.peephole.split(",") if rule]
+    if args.layout is not None:
+        options["layout"] = layout.read_json(args.layout, "layout")
+    if args.counts is not None:
+        options["counts"] = layout.read_json(args.counts, "counts")
+
+    if args.many:
+        if args.layout or args.counts or args.dump_layout or args.source_map:
+            arg_parser.error("layouts, counts and source maps are per program, they can't be used with --many")
+        failed = 0
+        paths = args.many + [path for path in (args.input, args.output) if path is not None]
+        for source, out_path, error, seconds in compile_many(paths, args.out_dir, args.jobs, options, args.cache,
+                                                             args.cache_limit * 2 ** 20):
+            if error is None:
+                print(f"{source} -> {out_path} ({seconds * 1000:.1f} ms)")
+            else:
+                failed += 1
+                print(f"{source}: {error}", file=sys.stderr)
+        return 1 if failed else 0
+
+    if args.input is None or args.output is None:
+        arg_parser.error("an input and an output file are required")
+    use_cache = args.cache is not None and not args.pass_times and not args.peephole_stats
+    compiler = Compiler(options, cache.Cache(args.cache, args.cache_limit * 2 ** 20) if use_cache else None)
+    compiler.compile_file(args.input, args.output, args.source_map)
+    if args.dump_layout is not None:
+        layout.write_json(args.dump_layout, compiler.layout)
+    if args.pass_times:
+        for name, seconds in compiler.pass_times.items():
+            print(f"{name}: {seconds * 1000:.2f} ms", file=sys.stderr)
+    if args.peephole_stats:
+        for rule, (instructions, cycles) in compiler.peephole_stats.items():
+            print(f"{rule}: {instructions} instructions, {cycles} cycles saved", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.tracebacklimit = 0
+    sys.exit(main())
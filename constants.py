@@ -0,0 +1,184 @@
+from instructions import ADD, SUB, RESET, INC, DEC, SHR, SHL, JUMP, JZERO, JODD, COSTS
+
+COPY_COST = COSTS[RESET] + COSTS[ADD]
+# How far from a known value it's still worth to look for a route of INCs and DECs.
+NEAR = 16
+# The loop multiplying two registers in calculate_expression: the checks done before it and every turn for a bit of
+# the multiplier, even ones jump over the ADD.
+MULTIPLICATION_SETUP = COSTS[RESET] + 3 * COSTS[JZERO] + COSTS[ADD] + COSTS[SUB]
+MULTIPLICATION_TURN = COSTS[JZERO] + COSTS[JODD] + COSTS[JUMP] + COSTS[SHR] + COSTS[SHL] + COSTS[JUMP]
+
+
+class ConstantSynthesizer:
+    # Finds the cheapest sequence of instructions leaving a constant in a register. A value is built from a smaller
+    # one by SHL and INC or by SHL and DEC from the next one (for instance 15 = 16 - 1), so the candidates for n are
+    # n // 2 and n // 2 + 1 and the search only visits about 2 log n values. The starting points are zero (after
+    # a RESET), the value already in the target register, and values in other registers, which can be copied
+    # (RESET, ADD) or added to and subtracted from the target.
+    def __init__(self):
+        # Routes from a register holding zero, shared by the whole compilation.
+        self.memo = {0: (0, None, None)}
+        # Routes multiplying a register by a constant, from a copy of the multiplicand.
+        self.products = {1: (0, None, None)}
+
+    def cost(self, value):
+        # Cost of building the value in a reset register.
+        return self.solve(value, self.memo, {})[0]
+
+    def plan(self, value, target, known):
+        # Returns the instructions as (op, register, argument) with register numbers; known maps register numbers to
+        # the values they are known to hold.
+        bases = {}
+        if known.get(target) is not None:
+            bases[known[target]] = (0, None)
+        for reg, reg_value in known.items():
+            if reg != target and reg_value is not None and reg_value not in bases:
+                bases[reg_value] = (COPY_COST, reg)
+        if 0 not in bases or bases[0][0] > COSTS[RESET]:
+            bases[0] = (COSTS[RESET], None)
+
+        if len(bases) == 1:
+            cost, route = bases[0][0] + self.solve(value, self.memo, {})[0], None
+        else:
+            memo = {}
+            cost = self.solve(value, memo, bases)[0]
+            route = memo
+        best = (cost, None, None)
+
+        # Top level ADD/SUB of a value from another register, e.g. b := 1000 when a holds 999 costs just ADD b a.
+        for reg, reg_value in known.items():
+            if reg == target or not reg_value:
+                continue
+            for op, rest in ((ADD, value - reg_value), (SUB, value + reg_value)):
+                if rest < 0 or op == SUB and value == 0:
+                    continue
+                memo = {}
+                rest_cost = self.solve(rest, memo, bases)[0] + COSTS[op]
+                if rest_cost < best[0]:
+                    best = (rest_cost, (op, reg), (rest, memo))
+
+        instructions = []
+        if best[1] is None:
+            if route is None:
+                if known.get(target) != 0:
+                    instructions.append((RESET, target, 0))
+                self.unwind(value, self.memo, {}, target, instructions)
+            else:
+                self.unwind(value, route, bases, target, instructions)
+        else:
+            rest, memo = best[2]
+            self.unwind(rest, memo, bases, target, instructions)
+            instructions.append((best[1][0], target, best[1][1]))
+        return instructions
+
+    def solve(self, value, memo, bases):
+        # Cheapest route to the value as (cost, kind, argument), memoized in memo. With no bases the route starts from
+        # a register holding zero.
+        def halves(value):
+            return (value // 2, value // 2 + 1) if value > 2 or value == 2 and bases else ()
+        return solve_from_below(value, memo, halves, lambda value: self.route(value, memo, bases))
+
+    def route(self, value, memo, bases):
+        # Cheapest route to the value, with the ones to half of it and the next value already in memo.
+        best = (float("inf"), None, None)
+        for base, (base_cost, _) in bases.items():
+            distance = abs(value - base)
+            if distance <= NEAR and base_cost + distance < best[0]:
+                best = (base_cost + distance, "base", base)
+            shifts = base.bit_length() - value.bit_length()
+            if shifts > 0 and base >> shifts == value and base_cost + shifts < best[0]:
+                best = (base_cost + shifts, "shift", base)
+        if not bases and value <= 2:
+            best = (value, "base", 0)
+        elif value >= 2:
+            half = value // 2
+            # SHL, then INC for odd values or two DECs for even ones from the next value (and the other way round)
+            from_half, from_next = (1, 3) if value % 2 == 0 else (2, 2)
+            candidates = [(memo[half][0] + from_half, "double", half)]
+            if half + 1 < value:
+                candidates.append((memo[half + 1][0] + from_next, "double", half + 1))
+            for candidate in candidates:
+                if candidate[0] < best[0]:
+                    best = candidate
+        return best
+
+    def unwind(self, value, memo, bases, target, instructions):
+        # The route goes down by halves to where it starts, the instructions are emitted on the way back up.
+        steps = [(value,) + self.solve(value, memo, bases)[1:]]
+        while steps[-1][1] == "double":
+            steps.append((steps[-1][2],) + memo[steps[-1][2]][1:])
+        for value, kind, argument in reversed(steps):
+            if kind is None:
+                continue
+            if kind == "double":
+                instructions.append((SHL, target, 0))
+                doubled = 2 * argument
+            else:
+                base_cost, source = bases.get(argument, (0, None))
+                if argument == 0 and not bases:
+                    pass
+                elif source is not None:
+                    instructions.append((RESET, target, 0))
+                    instructions.append((ADD, target, source))
+                elif base_cost:
+                    instructions.append((RESET, target, 0))
+                doubled = argument
+                if kind == "shift":
+                    while doubled > value:
+                        instructions.append((SHR, target, 0))
+                        doubled >>= 1
+            op = INC if value > doubled else DEC
+            instructions += [(op, target, 0)] * abs(value - doubled)
+
+    def multiplication(self, value):
+        # Returns the instructions multiplying a register holding a copy of the multiplicand by the value: SHLs of it
+        # and ADDs and SUBs of the multiplicand, or None when the loop multiplying two registers is cheaper.
+        # Products are built like constants, from half of the value by SHL and then ADD for odd values or SUB from the
+        # next even one (15x = 16x - x), which never goes below zero on the way.
+        cost = COPY_COST + self.solve_product(value)[0]
+        bits = value.bit_length()
+        loop_cost = COSTS[RESET] + self.cost(value) + MULTIPLICATION_SETUP + bits * MULTIPLICATION_TURN + \
+            bin(value).count("1") * (COSTS[ADD] - COSTS[JUMP]) + COSTS[JZERO]
+        if cost > loop_cost:
+            return None
+        instructions = []
+        while value > 1:
+            _, op, half = self.solve_product(value)
+            instructions.append(op)
+            if op != SHL:
+                value = value - 1 if op == ADD else value + 1
+                instructions.append(SHL)
+            value = half
+        return instructions[::-1]
+
+    def solve_product(self, value):
+        # Cheapest route to value times the multiplicand as (cost, last op, half of the value before the SHL).
+        def halves(value):
+            return (value // 2, value // 2 + 1) if value % 2 else (value // 2,)
+        return solve_from_below(value, self.products, halves, self.product_route)
+
+    def product_route(self, value):
+        half = value // 2
+        if value % 2 == 0:
+            return self.products[half][0] + COSTS[SHL], SHL, half
+        best = (self.products[half][0] + COSTS[SHL] + COSTS[ADD], ADD, half)
+        if half + 1 < value:
+            candidate = (self.products[half + 1][0] + COSTS[SHL] + COSTS[SUB], SUB, half + 1)
+            if candidate[0] < best[0]:
+                best = candidate
+        return best
+
+
+def solve_from_below(value, memo, halves, route):
+    # Memoizes route for the value and for the smaller values it is built from, given by halves, starting with the
+    # smallest ones so that route finds the routes it compares in memo. Literals can have thousands of bits, too many
+    # for recursing once for every bit.
+    levels = [[value]]
+    while levels[-1]:
+        levels.append(sorted({half for above in levels[-1] for half in halves(above) if half < above and
+                              half not in memo}))
+    for level in reversed(levels):
+        for below in level:
+            if below not in memo:
+                memo[below] = route(below)
+    return memo[value]
@@ -0,0 +1,111 @@
+from array import array
+import re
+
+# Mirrors virtual_machine/instructions.hh - the numbering must stay in sync with the C++ interpreter.
+GET, PUT, LOAD, STORE, ADD, SUB, RESET, INC, DEC, SHR, SHL, JUMP, JZERO, JODD, HALT = range(15)
+
+NAMES = ["GET", "PUT", "LOAD", "STORE", "ADD", "SUB", "RESET", "INC", "DEC", "SHR", "SHL", "JUMP", "JZERO", "JODD",
+         "HALT"]
+OPCODES = {name: opcode for opcode, name in enumerate(NAMES)}
+REGISTERS = "abcdef"
+REGISTER_NUMBERS = {name: number for number, name in enumerate(REGISTERS)}
+
+# Cycle costs charged by run_machine in virtual_machine/mw.cc. GET and PUT are accounted separately as i/o.
+COSTS = [100, 100, 20, 20, 5, 5, 1, 1, 1, 1, 1, 1, 1, 1, 0]
+IO = {GET, PUT}
+JUMPS = {JUMP, JZERO, JODD}
+
+
+def decode_line(line):
+    parts = line.split()
+    if not parts:
+        return None
+    if parts[0] not in OPCODES:
+        raise Exception(f"Unknown instruction '{parts[0]}'")
+    opcode = OPCODES[parts[0]]
+    register = 0
+    argument = 0
+    operands = parts[1:]
+    if opcode not in (JUMP, HALT):
+        if not operands or operands[0] not in REGISTER_NUMBERS:
+            raise Exception(f"Missing register in '{line.strip()}'")
+        register = REGISTER_NUMBERS[operands.pop(0)]
+    if opcode in (LOAD, STORE, ADD, SUB):
+        if not operands or operands[0] not in REGISTER_NUMBERS:
+            raise Exception(f"Missing second register in '{line.strip()}'")
+        argument = REGISTER_NUMBERS[operands.pop(0)]
+    elif opcode in JUMPS:
+        if not operands:
+            raise Exception(f"Missing jump offset in '{line.strip()}'")
+        argument = int(operands.pop(0))
+    if operands:
+        raise Exception(f"Unexpected operands in '{line.strip()}'")
+    return opcode, register, argument
+
+
+def decode(lines):
+    program = []
+    for line in lines:
+        instruction = decode_line(line)
+        if instruction is not None:
+            program.append(instruction)
+    return program
+
+
+def decode_text(text):
+    # Comments in the machine code are enclosed in parentheses and may span lines, same as in virtual_machine/lexer.l.
+    return decode(re.sub(r"\([^)]*\)", "", text).splitlines())
+
+
+def render(instruction):
+    opcode, register, argument = instruction
+    if opcode == HALT:
+        return "HALT"
+    elif opcode == JUMP:
+        return f"JUMP {argument}"
+    elif opcode in JUMPS:
+        return f"{NAMES[opcode]} {REGISTERS[register]} {argument}"
+    elif opcode in (LOAD, STORE, ADD, SUB):
+        return f"{NAMES[opcode]} {REGISTERS[register]} {REGISTERS[argument]}"
+    else:
+        return f"{NAMES[opcode]} {REGISTERS[register]}"
+
+
+class CodeBuffer:
+    # Instructions are kept as consecutive (opcode, register, argument) triples in a flat array of ints. Until the code
+    # is linked, the argument of a jump is the number of its label; link() turns it into a relative offset.
+    def __init__(self):
+        self.instructions = array('i')
+        self.labels = array('i')
+
+    def __len__(self):
+        return len(self.instructions) // 3
+
+    def __getitem__(self, position):
+        start = 3 * position
+        return tuple(self.instructions[start:start + 3])
+
+    def __iter__(self):
+        instructions = self.instructions
+        for start in range(0, len(instructions), 3):
+            yield instructions[start], instructions[start + 1], instructions[start + 2]
+
+    def append(self, op, reg=0, arg=0):
+        self.instructions.extend((op, reg, arg))
+
+    def label(self):
+        self.labels.append(-1)
+        return len(self.labels) - 1
+
+    def place(self, label):
+        self.labels[label] = len(self)
+
+    def link(self):
+        # Resolves all the labels into relative jump offsets in a single sweep over the code.
+        instructions, labels = self.instructions, self.labels
+        for start in range(0, len(instructions), 3):
+            if instructions[start] in JUMPS:
+                target = labels[instructions[start + 2]]
+                if target < 0:
+                    raise Exception(f"Jump to a label that was never placed at {start // 3}")
+                instructions[start + 2] = target - start // 3
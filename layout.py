@@ -0,0 +1,103 @@
+from register_allocator import loop_trips
+import json
+
+# Bumped whenever the format of the layout files changes.
+LAYOUT_VERSION = 1
+# Sections of both the layout (addresses) and the counts (accesses) of a program. Iterators take two addresses: their
+# own and the one of the number of iterations left, consts are the ones kept in memory for WRITE.
+SECTIONS = ("variables", "arrays", "iterators", "consts")
+
+
+def count_accesses(commands, weight=1, counts=None):
+    # Static estimate of how many times every symbol is accessed, weighted by the number of iterations of the loops
+    # around each access. Every symbol of the program gets an entry, even with no accesses.
+    if counts is None:
+        counts = {section: {} for section in SECTIONS}
+    for command in commands:
+        kind = command[0]
+        if kind in ("assign", "read"):
+            count_identifier(command[1], weight, counts)
+            if kind == "assign":
+                count_value(command[2], weight, counts)
+                if len(command) > 3:
+                    count_identifier(command[3], weight, counts)
+        elif kind == "write":
+            if command[1][0] == "const":
+                counts["consts"][command[1][1]] = counts["consts"].get(command[1][1], 0) + weight
+            else:
+                count_value(command[1], weight, counts)
+        elif kind in ("if", "ifelse"):
+            count_value(command[1], weight, counts)
+            for commands in command[2:4] if kind == "ifelse" else command[2:3]:
+                count_accesses(commands, weight, counts)
+        elif kind in ("while", "until"):
+            trips = loop_trips(command)
+            count_value(command[1], weight * (trips + 1), counts)
+            count_accesses(command[2], weight * trips, counts)
+        else:
+            # inside of the loop the iterator and the counter are almost always kept in registers
+            counts["iterators"][command[1]] = counts["iterators"].get(command[1], 0) + weight
+            count_value(command[2:4], weight, counts)
+            count_accesses(command[4], weight * loop_trips(command), counts)
+    return counts
+
+
+def count_value(value, weight, counts):
+    # Counts the identifiers in a value, an expression, a condition or a tuple of them.
+    if value[0] == "load":
+        count_identifier(value[1], weight, counts)
+    elif value[0] != "const":
+        for operand in value[1:] if type(value[0]) == str else value:
+            count_value(operand, weight, counts)
+
+
+def count_identifier(identifier, weight, counts):
+    if type(identifier) == str:
+        section, name = "variables", identifier
+    elif identifier[0] == "undeclared":
+        section, name = "iterators", identifier[1]
+    else:
+        section, name = "arrays", identifier[1]
+        if type(identifier[2]) == tuple:
+            count_value(identifier[2], weight, counts)
+    counts[section][name] = counts[section].get(name, 0) + weight
+
+
+def counts_from_profile(layout, accesses):
+    # Turns the numbers of accesses to memory addresses, as recorded by the machine, into the numbers of accesses to
+    # the symbols of the layout the program was compiled with.
+    owners = {}
+    for section in ("variables", "consts"):
+        for name, address in layout[section].items():
+            owners[address] = (section, name)
+    for name, addresses in layout["iterators"].items():
+        for address in addresses:
+            owners[address] = ("iterators", name)
+    counts = {section: {} for section in SECTIONS}
+    for address, count in accesses.items():
+        owner = owners.get(address)
+        if owner is None:
+            owner = next((("arrays", name) for name, (start, size) in layout["arrays"].items()
+                          if start <= address < start + size), None)
+        if owner is not None:
+            section, name = owner
+            counts[section][name] = counts[section].get(name, 0) + count
+    return counts
+
+
+def read_json(path, kind):
+    # Layouts and counts are stored as JSON. JSON only has string keys, so the consts are converted back to ints.
+    with open(path) as in_f:
+        data = json.load(in_f)
+    if kind == "layout" and data.get("version") != LAYOUT_VERSION:
+        raise Exception(f"Layout {path} has version {data.get('version')}, expected {LAYOUT_VERSION}")
+    for section in SECTIONS:
+        if section not in data:
+            raise Exception(f"No {section} in the {kind} {path}")
+    data["consts"] = {int(value): item for value, item in data["consts"].items()}
+    return data
+
+
+def write_json(path, data):
+    with open(path, "w") as out_f:
+        json.dump(data, out_f, indent=1, sort_keys=True)
@@ -0,0 +1,176 @@
+from instructions import GET, PUT, LOAD, STORE, ADD, SUB, RESET, INC, DEC, SHR, SHL, JUMP, JZERO, JODD, HALT, \
+    decode, decode_text
+import layout
+import source_map
+import random
+import argparse
+import sys
+
+
+class Result:
+    def __init__(self, output, cost, io, steps):
+        self.output = output
+        self.cost = cost
+        self.io = io
+        self.steps = steps
+
+    def __repr__(self):
+        return f"output {self.output}, cost {self.cost + self.io} (i/o: {self.io}), {self.steps} instructions"
+
+
+class Machine:
+    # A reimplementation of run_machine from virtual_machine/mw-cln.cc, charging the same cycle costs. The program
+    # is decoded into (opcode, register, argument) tuples once, so it can be run many times over cheaply.
+    def __init__(self, code, seed=None):
+        if isinstance(code, str):
+            self.program = decode_text(code)
+        else:
+            code = list(code)
+            self.program = decode(code) if code and isinstance(code[0], str) else code
+        self.random = random.Random(seed)
+
+    def run(self, inputs=(), max_steps=None, on_put=None, accesses=None, executions=None):
+        # accesses, if given, is a dict in which the number of reads and writes of every memory address is counted,
+        # executions a list with an item for every instruction, in which the number of its executions is counted.
+        program = self.program
+        size = len(program)
+        inputs = iter(inputs)
+        memory = {}
+        # the real machine starts with garbage in the registers, so programs can't rely on them being zeroed
+        r = [self.random.randrange(2 ** 31) for _ in range(6)]
+        output = []
+        lr = 0
+        t = 0
+        io = 0
+        steps = 0
+        limit = -1 if max_steps is None else max_steps
+        while True:
+            if lr < 0 or lr >= size:
+                raise Exception(f"Call of nonexistent instruction {lr}")
+            op, x, y = program[lr]
+            if op == HALT:
+                return Result(output, t, io, steps)
+            if steps == limit:
+                raise Exception(f"Step limit of {max_steps} exceeded")
+            steps += 1
+            if executions is not None:
+                executions[lr] += 1
+            if op == JZERO:
+                lr += y if r[x] == 0 else 1
+                t += 1
+            elif op == LOAD:
+                if accesses is not None:
+                    accesses[r[y]] = accesses.get(r[y], 0) + 1
+                r[x] = memory.get(r[y], 0)
+                t += 20
+                lr += 1
+            elif op == STORE:
+                if accesses is not None:
+                    accesses[r[y]] = accesses.get(r[y], 0) + 1
+                memory[r[y]] = r[x]
+                t += 20
+                lr += 1
+            elif op == INC:
+                r[x] += 1
+                t += 1
+                lr += 1
+            elif op == RESET:
+                r[x] = 0
+                t += 1
+                lr += 1
+            elif op == ADD:
+                r[x] += r[y]
+                t += 5
+                lr += 1
+            elif op == SUB:
+                r[x] = r[x] - r[y] if r[x] >= r[y] else 0
+                t += 5
+                lr += 1
+            elif op == JUMP:
+                lr += y
+                t += 1
+            elif op == SHL:
+                r[x] <<= 1
+                t += 1
+                lr += 1
+            elif op == SHR:
+                r[x] >>= 1
+                t += 1
+                lr += 1
+            elif op == DEC:
+                if r[x] > 0:
+                    r[x] -= 1
+                t += 1
+                lr += 1
+            elif op == JODD:
+                lr += y if r[x] & 1 else 1
+                t += 1
+            elif op == GET:
+                if accesses is not None:
+                    accesses[r[x]] = accesses.get(r[x], 0) + 1
+                try:
+                    memory[r[x]] = int(next(inputs))
+                except StopIteration:
+                    raise Exception("No more input for GET")
+                io += 100
+                lr += 1
+            elif op == PUT:
+                if accesses is not None:
+                    accesses[r[x]] = accesses.get(r[x], 0) + 1
+                value = memory.get(r[x], 0)
+                output.append(value)
+                if on_put is not None:
+                    on_put(value)
+                io += 100
+                lr += 1
+
+
+def read_stdin():
+    interactive = sys.stdin.isatty()
+    while True:
+        if interactive:
+            line = input("? ")
+        else:
+            line = sys.stdin.readline()
+            if not line:
+                return
+        yield from line.split()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a program for the register machine.")
+    parser.add_argument("program", help="machine code file")
+    parser.add_argument("-i", "--input", nargs="*", help="input values, read from stdin if not given")
+    parser.add_argument("--seed", type=int, help="seed for the initial register values")
+    parser.add_argument("--max-steps", type=int, help="abort after executing this many instructions")
+    parser.add_argument("--layout", metavar="FILE",
+                        help="layout the program was compiled with (compiler --dump-layout)")
+    parser.add_argument("--counts", metavar="FILE",
+                        help="save the numbers of accesses to the symbols of the layout, for compiler --counts")
+    parser.add_argument("--profile", metavar="SOURCE_MAP",
+                        help="report the lines of the source and the constructs that took the most cycles, by the "
+                             "source map of the program (compiler --source-map)")
+    parser.add_argument("--top", type=int, default=10, help="number of lines in the --profile report")
+    args = parser.parse_args(argv)
+    if args.counts is not None and args.layout is None:
+        parser.error("--counts needs the --layout of the program")
+
+    with open(args.program) as in_f:
+        machine = Machine(in_f.read(), args.seed)
+    inputs = read_stdin() if args.input is None else args.input
+    accesses = {} if args.counts is not None else None
+    executions = [0] * len(machine.program) if args.profile is not None else None
+    result = machine.run(inputs, args.max_steps, on_put=lambda value: print(">", value), accesses=accesses,
+                         executions=executions)
+    if accesses is not None:
+        layout.write_json(args.counts, layout.counts_from_profile(layout.read_json(args.layout, "layout"), accesses))
+    print(f"Finished (cost: {result.cost + result.io}; i/o: {result.io})")
+    if executions is not None:
+        print()
+        for line in source_map.report(source_map.read_json(args.profile), machine.program, executions, args.top):
+            print(line)
+
+
+if __name__ == "__main__":
+    sys.tracebacklimit = 0
+    main()
@@ -0,0 +1,84 @@
+from sly.yacc import Parser, ParserMeta, Production, _collect_grammar_rules
+import sly
+import hashlib
+import json
+import os
+import tempfile
+
+# SLY builds the LALR tables of a parser every time its class is created, which was most of the time it took to
+# compile a small program. The tables are kept in TABLES_PATH instead, together with a signature of the grammar they
+# were built from, and built again (and saved) only when the grammar has changed.
+
+# Bumped whenever the format of the tables file changes.
+TABLES_VERSION = 1
+TABLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parse_tables.json")
+
+
+class Tables:
+    # Everything SLY's parse uses of the grammar and of the LR tables of a parser, so it serves as both.
+    def __init__(self, productions, data):
+        self.Productions = productions
+        self.lr_action = {int(state): actions for state, actions in data["action"].items()}
+        self.lr_goto = {int(state): gotos for state, gotos in data["goto"].items()}
+        self.defaulted_states = {int(state): action for state, action in data["defaulted"].items()}
+
+
+def productions(parser, definitions):
+    # The productions of the grammar numbered the way SLY numbers them, the 0th one accepting the start symbol.
+    result = [None]
+    for _, value in definitions:
+        if callable(value) and hasattr(value, "rules"):
+            for func, _, _, name, symbols in _collect_grammar_rules(value):
+                result.append(Production(len(result), name, symbols, func=func))
+    start = getattr(parser, "start", None) or result[1].name
+    result[0] = Production(0, "S'", [start])
+    return result
+
+
+def signature(parser, productions):
+    data = [TABLES_VERSION, sly.__version__, sorted(parser.tokens), list(getattr(parser, "precedence", [])),
+            [[production.name, production.prod] for production in productions]]
+    return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+
+
+def generate(parser, definitions, signature):
+    # Lets SLY build the tables for a copy of the parser class, which also reports the conflicts in the grammar.
+    attributes = {name: value for name, value in definitions
+                  if name in ("tokens", "precedence", "start") or callable(value) and hasattr(value, "rules")}
+    attributes["_"] = None
+    built = ParserMeta(parser.__name__, (Parser,), attributes)
+    return {"version": TABLES_VERSION, "signature": signature, "action": built._lrtable.lr_action,
+            "goto": built._lrtable.lr_goto, "defaulted": built._lrtable.defaulted_states}
+
+
+def save(path, data):
+    # Written to a temporary file and renamed, so that processes starting at the same time never read half of it.
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".")
+    try:
+        with os.fdopen(handle, "w") as out_f:
+            json.dump(data, out_f, sort_keys=True)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except OSError:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def load(parser, definitions, path=TABLES_PATH):
+    # Sets up the tables of a parser class created with the given definitions (as SLY passes them to _build).
+    grammar = productions(parser, definitions)
+    expected = signature(parser, grammar)
+    try:
+        with open(path) as in_f:
+            data = json.load(in_f)
+    except (OSError, ValueError):
+        data = None
+    if not isinstance(data, dict) or data.get("version") != TABLES_VERSION or data.get("signature") != expected:
+        data = json.loads(json.dumps(generate(parser, definitions, expected)))
+        try:
+            save(path, data)
+        except OSError:
+            # e.g. installed in a read-only directory, the tables are just built again next time
+            pass
+    parser._grammar = parser._lrtable = Tables(grammar, data)
@@ -0,0 +1,35 @@
+import transform
+import time
+
+# Passes over the syntax tree run between parsing and laying out the memory, in this order. Every pass takes the
+# commands and the symbol table and changes the commands in place.
+PASSES = {
+    "constants": transform.propagate_constants,
+    "unroll": transform.unroll_loops,
+    "invariants": transform.hoist_invariants,
+    "dead": transform.eliminate_dead_code,
+    "divisions": transform.fuse_divisions,
+}
+
+
+def run(commands, symbols, names=None, settings=None):
+    # Runs the given passes (all of them for None) in the order of PASSES, settings maps the names of passes to the
+    # keyword arguments they get. Returns the seconds every pass took.
+    if names is None:
+        names = list(PASSES)
+    for name in names:
+        if name not in PASSES:
+            raise Exception(f"Unknown pass {name}")
+    # The passes mustn't change which programs the code generator accepts. One that reads a variable before any
+    # assignment to it is rejected whatever they do, so it's left as it is for the code generator to report that. In
+    # any other program, the passes that drop assignments keep their variables initialized (see keep_initialized).
+    if transform.uninitialized_variables(commands, symbols):
+        return {}
+    times = {}
+    for name, function in PASSES.items():
+        if name not in names:
+            continue
+        start = time.perf_counter()
+        function(commands, symbols, **(settings or {}).get(name, {}))
+        times[name] = time.perf_counter() - start
+    return times
@@ -0,0 +1,228 @@
+from instructions import GET, PUT, LOAD, STORE, ADD, SUB, RESET, INC, DEC, SHR, SHL, JUMP, JZERO, JODD, HALT, JUMPS, \
+    COSTS, CodeBuffer
+
+# Instructions whose only effect is writing their first register, so they can go if that register is dead afterwards.
+PURE = {LOAD, ADD, SUB, RESET, INC, DEC, SHR, SHL}
+
+
+def uses_and_defs(instruction):
+    op, x, y = instruction
+    if op in (ADD, SUB):
+        return 1 << x | 1 << y, 1 << x
+    elif op == LOAD:
+        return 1 << y, 1 << x
+    elif op == STORE:
+        return 1 << x | 1 << y, 0
+    elif op == RESET:
+        return 0, 1 << x
+    elif op in (INC, DEC, SHR, SHL):
+        return 1 << x, 1 << x
+    elif op in (GET, PUT, JZERO, JODD):
+        return 1 << x, 0
+    return 0, 0
+
+
+def successors(program, position):
+    op, _, target = program[position]
+    if op == HALT:
+        return ()
+    elif op == JUMP:
+        return target,
+    elif op in JUMPS:
+        return position + 1, target
+    return position + 1,
+
+
+def live_registers(program):
+    # Backward dataflow over the instructions; the sets of live registers are kept as bitmasks.
+    size = len(program)
+    info = [uses_and_defs(instruction) for instruction in program]
+    succ = [[s for s in successors(program, i) if s < size] for i in range(size)]
+    live_in = [0] * size
+    live_out = [0] * size
+    changed = True
+    while changed:
+        changed = False
+        for i in range(size - 1, -1, -1):
+            out = 0
+            for s in succ[i]:
+                out |= live_in[s]
+            uses, defs = info[i]
+            new_in = uses | (out & ~defs)
+            live_out[i] = out
+            if new_in != live_in[i]:
+                live_in[i] = new_in
+                changed = True
+    return live_out
+
+
+def jump_targets(program):
+    return {target for op, _, target in program if op in JUMPS}
+
+
+def jump_to_next(program):
+    # JUMP 1, JZERO x 1 and JODD x 1 don't do anything besides costing a cycle.
+    saved = []
+    for i, (op, _, target) in enumerate(program):
+        if op in JUMPS and target == i + 1:
+            program[i] = None
+            saved.append(COSTS[op])
+    return saved
+
+
+def jump_chain(program):
+    # A jump to an unconditional jump can go straight to its destination, which saves executing the second jump.
+    saved = []
+    for i, (op, reg, target) in enumerate(program):
+        if op not in JUMPS:
+            continue
+        destination, visited = target, {i}
+        while program[destination][0] == JUMP and destination not in visited:
+            visited.add(destination)
+            destination = program[destination][2]
+        if destination != target and destination not in visited:
+            program[i] = (op, reg, destination)
+            saved.append(COSTS[JUMP])
+    return saved
+
+
+def dead_register_write(program):
+    # For instance RESET x followed by another RESET x, or a copy into a register that is never read afterwards.
+    saved = []
+    live_out = live_registers(program)
+    for i, instruction in enumerate(program):
+        if instruction[0] in PURE and not live_out[i] & 1 << instruction[1]:
+            program[i] = None
+            saved.append(COSTS[instruction[0]])
+    return saved
+
+
+def zero_operand(program):
+    # ADD x y and SUB x y don't change x if y was just reset, e.g. when subtracting the first index of an array
+    # declared from 0. Registers are only known to be zero within a block without jumps into it.
+    saved = []
+    targets = jump_targets(program)
+    zeros = 0
+    for i, (op, x, y) in enumerate(program):
+        if i in targets:
+            zeros = 0
+        if op in (ADD, SUB) and zeros & 1 << y:
+            program[i] = None
+            saved.append(COSTS[op])
+            continue
+        defs = uses_and_defs((op, x, y))[1]
+        if op == RESET:
+            zeros |= defs
+        elif op in JUMPS and op != JUMP:
+            continue
+        else:
+            zeros &= ~defs
+    return saved
+
+
+def store_reload(program):
+    # STORE x y followed by LOAD z y reads back the value that is still in x.
+    saved = []
+    targets = jump_targets(program)
+    i = 0
+    while i < len(program) - 1:
+        (op, x, y), (next_op, z, w) = program[i], program[i + 1]
+        if op == STORE and next_op == LOAD and y == w and i + 1 not in targets:
+            if z == x:
+                program[i + 1] = None
+                saved.append(COSTS[LOAD])
+            else:
+                program[i + 1] = [(RESET, z, 0), (ADD, z, x)]
+                saved.append(COSTS[LOAD] - COSTS[RESET] - COSTS[ADD])
+            i += 1
+        i += 1
+    return saved
+
+
+def copy_propagation(program):
+    # RESET x, ADD x y, RESET z, ADD z x copies y to z through x. The second copy can be made straight from y, which
+    # often leaves the first one dead. If z is y itself, the second copy is not needed at all.
+    saved = []
+    targets = jump_targets(program)
+    i = 0
+    while i < len(program) - 3:
+        first, second, third, fourth = program[i:i + 4]
+        if first[0] == RESET and second[0] == ADD and second[1] == first[1] != second[2] and third[0] == RESET \
+                and fourth[0] == ADD and fourth[1] == third[1] != first[1] and fourth[2] == first[1] \
+                and not targets.intersection(range(i + 1, i + 4)):
+            if third[1] == second[2]:
+                program[i + 2] = program[i + 3] = None
+                saved.append(COSTS[RESET] + COSTS[ADD])
+            else:
+                program[i + 3] = (ADD, third[1], second[2])
+                saved.append(0)
+            i += 3
+        i += 1
+    return saved
+
+
+# Rules in the order they are applied, all of them are enabled by default.
+RULES = {
+    "jump_to_next": jump_to_next,
+    "jump_chain": jump_chain,
+    "zero_operand": zero_operand,
+    "copy_propagation": copy_propagation,
+    "store_reload": store_reload,
+    "dead_register_write": dead_register_write,
+}
+
+
+def compact(program, origins=None):
+    # Drops the removed instructions (None) and splices in replacements (lists), moving the jump targets accordingly.
+    # A jump to a removed instruction lands on the first instruction after it. origins, if given, is the list of where
+    # every instruction comes from (see CodeGenerator.origins), it's updated the same way: a replacement comes from
+    # where the instruction it replaces did.
+    positions = []
+    position = 0
+    for instruction in program:
+        positions.append(position)
+        if instruction is not None:
+            position += len(instruction) if type(instruction) == list else 1
+    positions.append(position)
+    result = []
+    kept = []
+    for i, instruction in enumerate(program):
+        if instruction is None:
+            continue
+        for op, reg, arg in (instruction if type(instruction) == list else [instruction]):
+            result.append((op, reg, positions[arg] if op in JUMPS else arg))
+            kept.append(i)
+    if origins is not None:
+        origins[:] = [origins[i] for i in kept]
+    return result
+
+
+def optimize(code, rules=None, origins=None):
+    # Runs the rules over linked code until none of them applies anymore. Returns the optimized code and, for every
+    # rule, the number of instructions it removed and the cycles it saved per execution of the affected instructions.
+    # origins, if given, is kept in line with the code (see compact).
+    if rules is None:
+        rules = list(RULES)
+    for name in rules:
+        if name not in RULES:
+            raise Exception(f"Unknown peephole rule {name}")
+    program = [(op, reg, position + arg if op in JUMPS else arg) for position, (op, reg, arg) in enumerate(code)]
+    stats = {name: [0, 0] for name in rules}
+    changed = True
+    while changed:
+        changed = False
+        for name in RULES:
+            if name not in stats:
+                continue
+            size = len(program)
+            saved = RULES[name](program)
+            if saved:
+                program = compact(program, origins)
+                stats[name][0] += size - len(program)
+                stats[name][1] += sum(saved)
+                changed = True
+
+    result = CodeBuffer()
+    for position, (op, reg, arg) in enumerate(program):
+        result.append(op, reg, arg - position if op in JUMPS else arg)
+    return result, stats
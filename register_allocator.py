@@ -0,0 +1,246 @@
+from symbol_table import Variable
+from instructions import LOAD, ADD, RESET, INC, REGISTER_NUMBERS, COSTS
+from constants import COPY_COST
+
+# Registers that can hold variables, in the order they are handed out. The code generator takes its scratch registers
+# from the other end (a, b, c, ...), so the first ones here are the last to be needed for something else.
+HOME_REGISTERS = "fedc"
+# How many times a loop is assumed to run when its bounds are not constants.
+LOOP_TRIPS = 10
+
+
+def loop_trips(loop):
+    if loop[0] in ("forup", "fordown") and loop[2][0] == loop[3][0] == "const":
+        first, last = loop[2][1], loop[3][1]
+        return max(last - first + 1 if loop[0] == "forup" else first - last + 1, 0)
+    return LOOP_TRIPS
+
+
+class Region:
+    # What the allocator gathers about a loop or the whole program. Uses of the scalars are weighted by how many times
+    # they get executed per entry to the region. Code that needs scratch registers splits into statements, around
+    # which a variable can be stored and loaded again, and conditions and loop headers, which set the lowest register
+    # a variable can get at all, since their code jumps away from the middle.
+    def __init__(self):
+        self.uses = {}
+        self.written = set()
+        self.hard = 0
+        self.soft = []
+
+
+class RegisterAllocator:
+    # Scalars are identified by keys: the name of a declared variable, ("undeclared", name) for an iterator (the same
+    # tuple the parser uses for it) and ("counter", name) for the number of iterations left in a FOR loop. Besides
+    # them, ("pointer", array, iterator) is the address of the element of the array at the iterator, which is moved
+    # along with the iterator; it only ever lives in a register and is computed again whenever it gets one. Each loop
+    # gets its own assignment of registers, chosen when the code generator enters it, so that the variables that are
+    # hot in an inner loop can take the registers of the ones that are only used outside of it.
+    def __init__(self, commands, symbols, constants):
+        self.commands = commands
+        self.symbols = symbols
+        self.constants = constants
+
+    def allocate(self, loop, homes, dirty, active):
+        # Returns the registers (letters) for the keys in the loop (None for the whole program) and the keys written
+        # in it. homes are the registers of the keys outside of the loop, dirty the ones whose values in the registers
+        # are newer than in memory and active the names of the iterators of the loops we are in.
+        region = self.region(loop)
+        names, local = list(active), set()
+        if loop is not None and loop[0] in ("forup", "fordown"):
+            names.append(loop[1])
+            local = {("undeclared", loop[1]), ("counter", loop[1])}
+            local.update(key for key in region.uses if type(key) == tuple and key[0] == "pointer" and key[2] == loop[1])
+        allowed = [reg for reg in HOME_REGISTERS if REGISTER_NUMBERS[reg] >= region.hard]
+
+        scores = {}
+        for key in list(region.uses) + list(homes):
+            if key in scores or not self.eligible(key, names):
+                continue
+            memory = self.memory_cost(key)
+            score = region.uses.get(key, 0) * (memory - COPY_COST)
+            if loop is not None:
+                if key in homes:
+                    # Taking the register away means storing the value and loading it back after the loop.
+                    score += memory * ((key in dirty) + 1)
+                elif key not in local:
+                    score -= memory * (self.initialized(key, active) + (key in region.written))
+                elif type(key) == tuple and key[0] == "pointer":
+                    # moved with the iterator on every iteration
+                    score -= loop_trips(loop) * COSTS[INC]
+            if score > 0:
+                scores[key] = score
+        chosen = sorted(scores, key=lambda key: -scores[key])[:len(allowed)]
+
+        result = {}
+        for key in chosen:
+            if homes.get(key) in allowed and homes[key] not in result.values():
+                result[key] = homes[key]
+        for key in chosen:
+            if key not in result:
+                result[key] = next(reg for reg in allowed if reg not in result.values())
+
+        # Statements that need the register of a variable force storing and reloading it, which might not pay off.
+        for key, reg in list(result.items()):
+            memory = self.memory_cost(key)
+            spill = memory * (1 + (key in region.written))
+            penalty = sum(weight * spill for demand, weight in region.soft if demand > REGISTER_NUMBERS[reg])
+            if penalty >= scores[key]:
+                del result[key]
+        return result, region.written
+
+    def eligible(self, key, names):
+        if type(key) == str:
+            return type(self.symbols.get(key)) == Variable
+        return key[-1] in names
+
+    def initialized(self, key, active):
+        if type(key) == str:
+            return self.symbols[key].initialized
+        return key[-1] in active
+
+    def address(self, key):
+        if type(key) == str:
+            return self.symbols[key].memory_offset
+        iterator = self.symbols.iterators[key[1]]
+        return iterator.memory_offset if key[0] == "undeclared" else iterator.limit_address
+
+    def memory_cost(self, key):
+        # Loading or storing the value: building the address and the memory access itself.
+        if type(key) == tuple and key[0] == "pointer":
+            # A pointer is used where it is, the cost is building it from the iterator instead.
+            array = self.symbols[key[1]]
+            offset = array.memory_offset - array.first_index
+            return COPY_COST + COSTS[RESET] + self.constants.cost(abs(offset)) + COSTS[ADD]
+        return COSTS[RESET] + self.constants.cost(self.address(key)) + COSTS[LOAD]
+
+    def region(self, loop):
+        region = Region()
+        if loop is None:
+            self.scan(self.commands, 1, region, True)
+            return region
+        trips = loop_trips(loop)
+        if loop[0] in ("while", "until"):
+            self.count_condition(loop[1], trips + (loop[0] == "while"), region)
+            region.hard = self.condition_demand(loop[1])
+            self.scan(loop[2], trips, region, True)
+        else:
+            iterator, counter = ("undeclared", loop[1]), ("counter", loop[1])
+            for value in loop[2:4]:
+                self.count_value(value, 1, region)
+            self.count(iterator, 1 + 2 * trips, region, True)
+            self.count(counter, 1 + 3 * trips, region, True)
+            region.hard = self.header_demand(loop)
+            self.scan(loop[4], trips, region, True)
+        return region
+
+    def scan(self, commands, weight, region, top):
+        # top is whether the commands belong to the region itself rather than to one of the loops inside it.
+        for command in commands:
+            kind = command[0]
+            if kind in ("assign", "read"):
+                target = command[1]
+                if type(target) == str or target[0] == "undeclared":
+                    self.count(target, weight, region, True)
+                else:
+                    self.count_value(("load", target), weight, region)
+                if kind == "assign":
+                    self.count_value(command[2], weight, region)
+                    if len(command) > 3:
+                        self.count(command[3], weight, region, True)
+            elif kind == "write":
+                self.count_value(command[1], weight, region)
+            elif kind in ("if", "ifelse"):
+                self.count_condition(command[1], weight, region)
+                if top:
+                    region.hard = max(region.hard, self.condition_demand(command[1]))
+                for commands in command[2:4] if kind == "ifelse" else command[2:3]:
+                    self.scan(commands, weight, region, top)
+                continue
+            else:
+                trips = loop_trips(command)
+                if kind in ("while", "until"):
+                    self.count_condition(command[1], weight * (trips + (kind == "while")), region)
+                    self.scan(command[2], weight * trips, region, False)
+                else:
+                    for value in command[2:4]:
+                        self.count_value(value, weight, region)
+                    self.scan(command[4], weight * trips, region, False)
+                continue
+            if top:
+                region.soft.append((self.demand(command), weight))
+
+    def count(self, key, weight, region, written=False):
+        region.uses[key] = region.uses.get(key, 0) + weight
+        if written:
+            region.written.add(key)
+
+    def count_value(self, value, weight, region):
+        if value[0] == "load":
+            if type(value[1]) == str or value[1][0] == "undeclared":
+                self.count(value[1], weight, region)
+            elif type(value[1][2]) == tuple:
+                self.count_value(value[1][2], weight, region)
+                if type(value[1][2][1]) == tuple:
+                    self.count(("pointer", value[1][1], value[1][2][1][1]), weight, region)
+        elif value[0] != "const":
+            for operand in value[1:]:
+                self.count_value(operand, weight, region)
+
+    def count_condition(self, condition, weight, region):
+        for value in condition[1:]:
+            self.count_value(value, weight, region)
+
+    # The numbers of scratch registers (a, b, c, ...) the code generator uses for a piece of code. These have to
+    # follow the code generator closely - it refuses to overwrite a register that holds a variable. The demands of
+    # statements can take the current homes into account, the ones of conditions and loop headers can't, as they
+    # decide which registers can be homes at all.
+
+    def value_demand(self, value, homes=()):
+        if value[0] == "load" and type(value[1]) == tuple and value[1][0] == "array" and type(value[1][2]) == tuple:
+            # The array's offset is added to the index in a second register, unless the address is already in a
+            # register or the offset can be built in place.
+            array, index = value[1][1], value[1][2][1]
+            offset = self.symbols[array].memory_offset - self.symbols[array].first_index
+            if type(index) == tuple and ("pointer", array, index[1]) in homes or index in homes and offset >= 0:
+                return 1
+            elif abs(offset) <= COSTS[RESET] + self.constants.cost(abs(offset)) + COSTS[ADD]:
+                return 1
+            return 2
+        return 1
+
+    def expression_demand(self, expression, homes=()):
+        if expression[0] in ("const", "load"):
+            return self.value_demand(expression, homes)
+        first, second = self.value_demand(expression[1], homes), self.value_demand(expression[2], homes)
+        if expression[0] in ("add", "sub"):
+            return max(first, 1 + second)
+        elif expression[0] == "mul":
+            for const, var in ((1, 2), (2, 1)):
+                if expression[const][0] == "const" and expression[const][1] & (expression[const][1] - 1) == 0:
+                    return self.value_demand(expression[var], homes)
+                elif expression[const][0] == "const" and self.constants.multiplication(expression[const][1]):
+                    return 1 + self.value_demand(expression[var], homes)
+            return 3
+        elif expression[0] == "div" and expression[2][0] == "const" and expression[2][1] & (expression[2][1] - 1) == 0:
+            return first
+        elif expression[0] == "mod" and expression[2][0] == "const" and expression[2][1] & (expression[2][1] - 1) == 0:
+            return 2
+        return 5
+
+    def condition_demand(self, condition):
+        if condition[1] == ("const", 0) or condition[2] == ("const", 0):
+            return 2
+        elif condition[0] in ("eq", "ne"):
+            return 3
+        return 2 + (self.value_demand(condition[1]) == 2 or self.value_demand(condition[2]) == 2)
+
+    def header_demand(self, loop):
+        return 2 + (self.value_demand(loop[2]) == 2 or self.value_demand(loop[3]) == 2)
+
+    def demand(self, command, homes=()):
+        if command[0] == "write":
+            return 2 if command[1][0] == "const" else self.value_demand(command[1], homes)
+        target = self.value_demand(("load", command[1]), homes)
+        if command[0] == "read":
+            return target
+        return max(self.expression_demand(command[2], homes), 1 + target)
@@ -0,0 +1,102 @@
+from instructions import COSTS
+import json
+import os
+
+# Where the instructions of a compiled program come from: the line of the source and the construct, which is the kind
+# of the command (assign, read, write, if, while, until, for) or a part of it - its condition, the expansion of a
+# multiplication or a division (mul, div, mod), or moving the variables kept in registers to and from memory
+# (registers). The code before and after the program itself comes from no line: storing the consts printed by WRITE
+# (consts) and halting (halt). Together with the numbers of executions of every instruction recorded by the machine
+# this tells which lines and constructs the cycles go to.
+
+# Bumped whenever the format of the source map files changes.
+SOURCE_MAP_VERSION = 1
+
+
+class SourceLines:
+    # Lines of the commands of a program, kept aside of the syntax tree. Commands are tuples, which the passes build
+    # anew to change them, so every pass hands the line of a command over to the commands replacing it (derive).
+    def __init__(self):
+        # id of a command -> the command and its line; holding the command keeps its id from being reused
+        self.entries = {}
+
+    def record(self, command, line):
+        self.entries[id(command)] = (command, line)
+
+    def derive(self, command, new):
+        # Gives new the line of the command it replaces or comes from, unless it has one already. Returns new.
+        if id(new) not in self.entries and id(command) in self.entries:
+            self.entries[id(new)] = (new, self.entries[id(command)][1])
+        return new
+
+    def line(self, command):
+        entry = self.entries.get(id(command))
+        return entry[1] if entry is not None else None
+
+
+def ranges(origins):
+    # Compresses the (line, construct) of every instruction into [first instruction, line, construct] of the runs
+    # of instructions with the same origin.
+    result = []
+    for position, origin in enumerate(origins):
+        if not result or tuple(result[-1][1:]) != tuple(origin):
+            result.append([position, origin[0], origin[1]])
+    return result
+
+
+def origins_from_ranges(data, size):
+    origins = []
+    for i, (start, line, construct) in enumerate(data["ranges"]):
+        end = data["ranges"][i + 1][0] if i + 1 < len(data["ranges"]) else size
+        origins += [(line, construct)] * (end - start)
+    return origins
+
+
+def write_json(path, source, ranges):
+    with open(path, "w") as out_f:
+        json.dump({"version": SOURCE_MAP_VERSION, "source": os.path.abspath(source), "ranges": ranges}, out_f)
+
+
+def read_json(path):
+    with open(path) as in_f:
+        data = json.load(in_f)
+    if data.get("version") != SOURCE_MAP_VERSION:
+        raise Exception(f"Source map {path} has version {data.get('version')}, expected {SOURCE_MAP_VERSION}")
+    return data
+
+
+def hot_spots(program, executions, origins):
+    # Adds up the executed instructions and the cycles (i/o included) by line and by construct. Returns two dicts
+    # mapping them to [instructions, cycles].
+    lines, constructs = {}, {}
+    for (op, _, _), count, (line, construct) in zip(program, executions, origins):
+        if count:
+            for totals, key in ((lines, line), (constructs, construct)):
+                total = totals.setdefault(key, [0, 0])
+                total[0] += count
+                total[1] += count * COSTS[op]
+    return lines, constructs
+
+
+def report(data, program, executions, top=10):
+    # The hot spot report as lines of text: the lines of the source that took the most cycles, then all the
+    # constructs, both sorted by the cycles.
+    origins = origins_from_ranges(data, len(program))
+    if len(origins) != len(program):
+        raise Exception(f"Source map is for {len(origins)} instructions, the program has {len(program)}")
+    lines, constructs = hot_spots(program, executions, origins)
+    total = sum(cycles for _, cycles in lines.values()) or 1
+    try:
+        with open(data["source"]) as in_f:
+            source = in_f.read().splitlines()
+    except OSError:
+        source = []
+    result = [f"{'line':>6} {'cycles':>14} {'share':>6} {'instructions':>14}  source"]
+    for line, (count, cycles) in sorted(lines.items(), key=lambda item: -item[1][1])[:top]:
+        text = source[line - 1].strip() if line is not None and line <= len(source) else ""
+        result.append(f"{'-' if line is None else line:>6} {cycles:>14} {cycles / total:>6.1%} {count:>14}  {text}")
+    result.append("")
+    result.append(f"{'construct':>10} {'cycles':>14} {'share':>6} {'instructions':>14}")
+    for construct, (count, cycles) in sorted(constructs.items(), key=lambda item: -item[1][1]):
+        result.append(f"{construct:>10} {cycles:>14} {cycles / total:>6.1%} {count:>14}")
+    return result
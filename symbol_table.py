@@ -1,3 +1,9 @@
+from constants import ConstantSynthesizer
+from source_map import SourceLines
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+
 class Array:
     def __init__(self, name, memory_offset, first_index, last_index):
         self.name = name
@@ -33,12 +39,33 @@ class Iterator:
         return f"iterator at {self.memory_offset}"
 
 
+def free_run(starts, ends, address):
+    # The start of the free run of addresses holding the address, None if the address is taken.
+    i = bisect_right(starts, address) - 1
+    return starts[i] if i >= 0 and address < ends[starts[i]] else None
+
+
+def take(starts, ends, run, start, size):
+    # Takes the addresses from start to start + size out of the free run starting at run.
+    end = ends.pop(run)
+    pieces = [(begin, stop) for begin, stop in ((run, start), (start + size, end)) if begin < stop]
+    i = bisect_left(starts, run)
+    starts[i:i + 1] = [begin for begin, _ in pieces]
+    ends.update(pieces)
+
+
 class SymbolTable(dict):
     def __init__(self):
         super().__init__()
         self.memory_offset = 0
+        self.temporaries = 0
         self.consts = {}
         self.iterators = {}
+        # Addresses set aside by the layout for the consts and the iterators added during code generation.
+        self.reserved_consts = {}
+        self.reserved_iterators = {}
+        # Lines of the source the commands come from, for the source map.
+        self.lines = SourceLines()
 
     def add_variable(self, name):
         if name in self:
@@ -46,6 +73,18 @@ class SymbolTable(dict):
         self.setdefault(name, Variable(self.memory_offset))
         self.memory_offset += 1
 
+    def add_temporary(self):
+        # A variable for a value the compiler keeps for later, named so that it can't clash with the program's ones.
+        self.temporaries += 1
+        name = f"#{self.temporaries}"
+        self.add_variable(name)
+        return name
+
+    def remove_unused(self, used):
+        # Forgets the variables and arrays not among the used names, so that the layout gives them no memory.
+        for name in [name for name in self if name not in used]:
+            del self[name]
+
     def add_array(self, name, begin, end):
         if name in self:
             raise Exception(f"Redeclaration of {name}")
@@ -54,12 +93,106 @@ class SymbolTable(dict):
         self.setdefault(name, Array(name, self.memory_offset, begin, end))
         self.memory_offset += (end - begin) + 1
 
+    def lay_out(self, counts):
+        # Gives the addresses that are the cheapest to build (0, 1, 2, 3, 4, 6, 8, ...) to the most accessed symbols:
+        # variables, iterators with their counters, consts and the arrays small enough to fit among these addresses.
+        # Bigger arrays take the first gap that is big enough afterwards. counts are numbers of accesses as returned
+        # by layout.count_accesses, they also tell which iterators and consts there are - these only get added to the
+        # table during code generation.
+        symbols = [(counts["variables"].get(name, 0), "variables", name) for name in self
+                   if type(self[name]) == Variable]
+        for name, count in counts["iterators"].items():
+            symbols += [(count, "iterators", name), (count, "counters", name)]
+        symbols += [(count, "consts", value) for value, count in counts["consts"].items()]
+        cost = ConstantSynthesizer().cost
+        cheap = sorted(range(4 * len(symbols) + 16), key=lambda address: (cost(address), address))
+        big = []
+        for name in self:
+            if type(self[name]) == Array:
+                size = self[name].last_index - self[name].first_index + 1
+                (symbols if size <= len(cheap) // 4 else big).append((counts["arrays"].get(name, 0), "arrays", name))
+        symbols.sort(key=lambda symbol: -symbol[0])
+        big.sort(key=lambda symbol: -symbol[0])
+
+        # The free addresses in runs, kept sorted by where they start: starts and the end of the run starting at each.
+        # The last run never ends.
+        starts, ends = [0], {0: float("inf")}
+        # cheap[:first] are all taken
+        first = 0
+        placed = {}
+        for symbols_left, may_be_cheap in ((symbols, True), (big, False)):
+            for _, section, name in symbols_left:
+                size = self[name].last_index - self[name].first_index + 1 if section == "arrays" else 1
+                start = None
+                if may_be_cheap:
+                    while first < len(cheap) and free_run(starts, ends, cheap[first]) is None:
+                        first += 1
+                    for address in islice(cheap, first, None):
+                        run = free_run(starts, ends, address)
+                        if run is not None and address + size <= min(ends[run], len(cheap)):
+                            start = address
+                            break
+                if start is None:
+                    # the first gap big enough, which might be after everything, is the last resort
+                    start = next(run for run in starts if ends[run] - run >= size)
+                take(starts, ends, free_run(starts, ends, start), start, size)
+                placed[section, name] = start
+        self.place_symbols(placed)
+
+    def apply_layout(self, layout):
+        # Reuses the addresses of a layout returned by layout(), e.g. to reproduce an earlier build.
+        placed = {}
+        for name in self:
+            section = "variables" if type(self[name]) == Variable else "arrays"
+            if name not in layout[section]:
+                raise Exception(f"No address for {name} in the layout")
+            placed[section, name] = layout[section][name][0] if section == "arrays" else layout[section][name]
+        for name, (address, limit_address) in layout["iterators"].items():
+            placed["iterators", name] = address
+            placed["counters", name] = limit_address
+        for value, address in layout["consts"].items():
+            placed["consts", value] = address
+        self.place_symbols(placed)
+
+    def place_symbols(self, placed):
+        self.reserved_iterators = {}
+        self.reserved_consts = {}
+        end = 0
+        for (section, name), address in placed.items():
+            if section in ("variables", "arrays"):
+                self[name].memory_offset = address
+            elif section == "iterators":
+                self.reserved_iterators[name] = (address, placed["counters", name])
+            elif section == "consts":
+                self.reserved_consts[name] = address
+            size = self[name].last_index - self[name].first_index + 1 if section == "arrays" else 1
+            end = max(end, address + size)
+        self.memory_offset = end
+
+    def addresses(self):
+        # Addresses of all the symbols, the sections of a layout file (see layout.read_json).
+        return {
+            "variables": {name: self[name].memory_offset for name in self if type(self[name]) == Variable},
+            "arrays": {name: [self[name].memory_offset, self[name].last_index - self[name].first_index + 1]
+                       for name in self if type(self[name]) == Array},
+            "iterators": {name: [iterator.memory_offset, iterator.limit_address]
+                          for name, iterator in self.iterators.items()},
+            "consts": dict(self.consts),
+        }
+
     def add_const(self, value):
+        if value in self.reserved_consts:
+            self.consts.setdefault(value, self.reserved_consts[value])
+            return self.consts[value]
         self.consts.setdefault(value, self.memory_offset)
         self.memory_offset += 1
         return self.memory_offset - 1
 
     def add_iterator(self, name):
+        if name in self.reserved_iterators:
+            address, last_address = self.reserved_iterators[name]
+            self.iterators.setdefault(name, Iterator(address, last_address))
+            return address, last_address
         last_address = self.memory_offset
         self.memory_offset += 1
         self.iterators.setdefault(name, Iterator(self.memory_offset, last_address))
@@ -0,0 +1,611 @@
+from symbol_table import Array, Variable
+from code_generator import simplify_condition
+import cfg
+
+# Rewrites of the syntax tree done after parsing and before laying out the memory. Command lists are changed in place.
+
+
+def nested_blocks(command):
+    # The command lists inside an if, a loop or a FOR.
+    if command[0] == "ifelse":
+        return [command[2], command[3]]
+    elif command[0] in ("if", "while", "until"):
+        return [command[2]]
+    elif command[0] in ("forup", "fordown"):
+        return [command[4]]
+    return []
+
+
+def reads(value, target):
+    # Whether writing the target can change the value.
+    if value[0] != "load":
+        return False
+    ident = value[1]
+    if type(target) == str:
+        return ident == target or ident[0] == "array" and ident[2] == ("load", target)
+    return type(ident) == tuple and ident[0] == "array" and ident[1] == target[1]
+
+
+# Values of operations on constants, which are never negative - subtraction stops at zero and so does division by it.
+OPERATIONS = {
+    "add": lambda a, b: a + b,
+    "sub": lambda a, b: max(a - b, 0),
+    "mul": lambda a, b: a * b,
+    "div": lambda a, b: a // b if b else 0,
+    "mod": lambda a, b: a % b if b else 0,
+}
+COMPARISONS = {
+    "eq": lambda a, b: a == b,
+    "ne": lambda a, b: a != b,
+    "lt": lambda a, b: a < b,
+    "gt": lambda a, b: a > b,
+    "le": lambda a, b: a <= b,
+    "ge": lambda a, b: a >= b,
+}
+# How many commands the copies of the body of an unrolled loop can have together.
+UNROLL_BUDGET = 64
+
+
+def propagate_constants(commands, symbols):
+    # Replaces reads of variables that are known to hold a constant at that point with the constant, folds the
+    # expressions and conditions that become constant and drops the branches and loops that can't run. WRITE keeps
+    # reading the variable, which is cheaper than storing the constant somewhere to print it. Assignments of
+    # constants to variables that are no longer read anywhere are dropped afterwards; a variable that is never read
+    # doesn't need to be initialized either, so no error about that can get lost.
+    fold_block(commands, {}, symbols)
+    drop_dead_constants(commands, read_variables(commands, set()), symbols)
+
+
+def fold_block(commands, known, symbols):
+    # known maps the variables holding a constant before the commands to their values, it's updated to the ones
+    # after them.
+    lines = symbols.lines
+    result = []
+    for command in commands:
+        kind = command[0]
+        if kind == "assign":
+            target, expression = fold_target(command[1], known, symbols), fold_value(command[2], known, symbols)
+            if type(target) == str:
+                if expression[0] == "const":
+                    known[target] = expression[1]
+                else:
+                    known.pop(target, None)
+            result.append(lines.derive(command, (kind, target, expression) + command[3:]))
+        elif kind == "read":
+            known.pop(command[1], None)
+            result.append(lines.derive(command, (kind, fold_target(command[1], known, symbols))))
+        elif kind == "write":
+            result.append(lines.derive(command, (kind, ("load", fold_target(command[1][1], known, symbols))
+                                                 if command[1][0] == "load" else command[1])))
+        elif kind in ("if", "ifelse"):
+            condition = fold_value(command[1], known, symbols)
+            decided = decide(condition)
+            if decided is not None:
+                branch = command[2] if decided else command[3] if kind == "ifelse" else []
+                for block in nested_blocks(command):
+                    if block is not branch:
+                        keep_initialized(block, symbols)
+                fold_block(branch, known, symbols)
+                result += branch
+                continue
+            branches = command[2:4] if kind == "ifelse" else command[2:3]
+            outcomes = [fold_block(branch, dict(known), symbols) for branch in branches]
+            if kind == "if":
+                outcomes.append(dict(known))
+            known.clear()
+            known.update({name: value for name, value in outcomes[0].items()
+                          if all(outcome.get(name) == value for outcome in outcomes[1:])})
+            result.append(lines.derive(command, (kind, condition) + command[2:]))
+        elif kind == "while":
+            if decide(fold_value(command[1], known, symbols)) is False:
+                keep_initialized(command[2], symbols)
+                continue
+            forget(known, assigned_variables(command[2], set()))
+            condition = fold_value(command[1], known, symbols)
+            fold_block(command[2], dict(known), symbols)
+            result.append(lines.derive(command, (kind, condition) + command[2:]))
+        elif kind == "until":
+            # the condition is checked after the body, the loop ends in the state the body leaves behind
+            forget(known, assigned_variables(command[2], set()))
+            fold_block(command[2], known, symbols)
+            result.append(lines.derive(command, (kind, fold_value(command[1], known, symbols), command[2])))
+        else:
+            first, last = fold_value(command[2], known, symbols), fold_value(command[3], known, symbols)
+            if first[0] == last[0] == "const" and (first[1] > last[1] if kind == "forup" else first[1] < last[1]):
+                keep_initialized(command[4], symbols)
+                continue
+            forget(known, assigned_variables(command[4], set()))
+            fold_block(command[4], dict(known), symbols)
+            result.append(lines.derive(command, (kind, command[1], first, last) + command[4:]))
+    commands[:] = result
+    return known
+
+
+def fold_value(value, known, symbols):
+    # Folds a value, an expression or a condition.
+    if value[0] == "const":
+        return value
+    elif value[0] == "load":
+        if type(value[1]) == str and value[1] in known:
+            return "const", known[value[1]]
+        return "load", fold_target(value[1], known, symbols)
+    operands = tuple(fold_value(operand, known, symbols) for operand in value[1:])
+    if value[0] in OPERATIONS and operands[0][0] == operands[1][0] == "const":
+        return "const", OPERATIONS[value[0]](operands[0][1], operands[1][1])
+    return (value[0],) + operands
+
+
+def fold_target(ident, known, symbols):
+    # An array indexed by a variable holding a constant becomes an array at that index, as long as it's in range.
+    if type(ident) == tuple and ident[0] == "array" and type(ident[2]) == tuple and ident[2][1] in known:
+        index, array = known[ident[2][1]], symbols.get(ident[1])
+        if type(array) == Array and array.first_index <= index <= array.last_index:
+            return "array", ident[1], index
+    return ident
+
+
+def decide(condition):
+    if condition[1][0] == condition[2][0] == "const":
+        return COMPARISONS[condition[0]](condition[1][1], condition[2][1])
+
+
+def forget(known, names):
+    for name in names:
+        known.pop(name, None)
+
+
+def keep_initialized(commands, symbols):
+    # The code generator takes a variable for initialized from its first assignment in the program text on, even if
+    # that never runs. Dropping commands that can't run, which only happens to programs reading no variable before
+    # its first assignment, marks the variables they assign as initialized from the start instead.
+    for name in assigned_variables(commands, set()):
+        if type(symbols.get(name)) == Variable:
+            symbols[name].initialized = True
+
+
+def assigned_variables(commands, names):
+    for command in commands:
+        if command[0] in ("assign", "read") and type(command[1]) == str:
+            names.add(command[1])
+        for block in nested_blocks(command):
+            assigned_variables(block, names)
+    return names
+
+
+def read_variables(commands, names):
+    for command in commands:
+        kind = command[0]
+        if kind in ("assign", "read"):
+            if type(command[1]) == tuple:
+                # the index of an array
+                value_variables(("load", command[1]), names)
+            if kind == "assign":
+                value_variables(command[2], names)
+        elif kind in ("forup", "fordown"):
+            value_variables(command[2], names)
+            value_variables(command[3], names)
+        else:
+            value_variables(command[1], names)
+        for block in nested_blocks(command):
+            read_variables(block, names)
+    return names
+
+
+def value_variables(value, names):
+    if value[0] == "load":
+        ident = value[1]
+        if type(ident) == tuple and ident[0] == "array" and type(ident[2]) == tuple:
+            value_variables(ident[2], names)
+        elif type(ident) == str:
+            names.add(ident)
+    elif value[0] != "const":
+        for operand in value[1:]:
+            value_variables(operand, names)
+
+
+def drop_dead_constants(commands, read, symbols):
+    commands[:] = [command for command in commands if command[0] != "assign" or type(command[1]) != str or
+                   type(symbols.get(command[1])) != Variable or command[1] in read or command[2][0] != "const"]
+    for command in commands:
+        for block in nested_blocks(command):
+            drop_dead_constants(block, read, symbols)
+
+
+def unroll_loops(commands, symbols, budget=UNROLL_BUDGET):
+    # Replaces FOR loops with constant bounds by copies of their bodies, one for every value of the iterator, with the
+    # iterator replaced by that value - so the arrays it indexes get constant addresses and whatever it was used for
+    # gets folded. Inner loops go first. A loop is unrolled only if all the copies together have at most budget
+    # commands. Loops that write their iterator or declare it again are left alone, so that the code generator can
+    # report these, and so are the ones that would index an array out of its range, which is only an error for
+    # constant indexes.
+    result = []
+    for command in commands:
+        for block in nested_blocks(command):
+            unroll_loops(block, symbols, budget)
+        kind = command[0]
+        if kind in ("forup", "fordown") and command[2][0] == command[3][0] == "const":
+            first, last = command[2][1], command[3][1]
+            values = range(first, last + 1) if kind == "forup" else range(first, last - 1, -1)
+            if len(values) * size(command[4]) <= budget and unrollable(command[4], command[1], values, symbols):
+                for value in values:
+                    body = substitute_commands(command[4], command[1], value, symbols.lines)
+                    fold_block(body, {}, symbols)
+                    result += body
+                continue
+        result.append(command)
+    commands[:] = result
+
+
+def size(commands):
+    return sum(1 + sum(size(block) for block in nested_blocks(command)) for command in commands)
+
+
+def unrollable(commands, iterator, values, symbols):
+    this = ("undeclared", iterator)
+    for command in commands:
+        kind = command[0]
+        if kind in ("assign", "read") and command[1] == this or kind in ("forup", "fordown") and \
+                command[1] == iterator:
+            return False
+        values_read = [command[1]] if kind in ("if", "ifelse", "while", "until", "write") else \
+            list(command[2:4]) if kind in ("forup", "fordown") else [("load", command[1])] + list(command[2:3])
+        if any(not in_range(value, this, values, symbols) for value in values_read):
+            return False
+        if not all(unrollable(block, iterator, values, symbols) for block in nested_blocks(command)):
+            return False
+    return True
+
+
+def in_range(value, this, values, symbols):
+    # Whether all the elements of arrays indexed by the iterator the value reads are in range for all its values.
+    if value[0] == "load":
+        ident = value[1]
+        if type(ident) == tuple and ident[0] == "array" and ident[2] == ("load", this):
+            array = symbols[ident[1]]
+            return array.first_index <= min(values) and max(values) <= array.last_index
+        return True
+    return value[0] == "const" or all(in_range(operand, this, values, symbols) for operand in value[1:])
+
+
+def substitute_commands(commands, iterator, number, lines):
+    # Copies of the commands with the iterator replaced by the number.
+    result = []
+    for command in commands:
+        kind = command[0]
+        if kind in ("assign", "read"):
+            target = substitute(("load", command[1]), iterator, number)[1]
+            copy = (kind, target) + tuple(substitute(value, iterator, number) for value in command[2:3]) + command[3:]
+        elif kind == "write":
+            copy = kind, substitute(command[1], iterator, number)
+        elif kind in ("forup", "fordown"):
+            copy = (kind, command[1], substitute(command[2], iterator, number),
+                    substitute(command[3], iterator, number), substitute_commands(command[4], iterator, number, lines))
+        else:
+            blocks = tuple(substitute_commands(block, iterator, number, lines) for block in nested_blocks(command))
+            copy = (kind, substitute(command[1], iterator, number)) + blocks
+        result.append(lines.derive(command, copy))
+    return result
+
+
+def substitute(value, iterator, number):
+    if value[0] == "load":
+        ident = value[1]
+        if ident == ("undeclared", iterator):
+            return "const", number
+        elif type(ident) == tuple and ident[0] == "array" and ident[2] == ("load", ("undeclared", iterator)):
+            return "load", ("array", ident[1], number)
+        return value
+    elif value[0] == "const":
+        return value
+    return (value[0],) + tuple(substitute(operand, iterator, number) for operand in value[1:])
+
+
+def hoist_invariants(commands, symbols):
+    # Computes the multiplications and divisions whose operands don't change inside a loop once, before the loop, into
+    # new variables. Going through the commands run on every iteration in order, a variable assigned a value that
+    # doesn't change in the loop is known to hold it until it's assigned again, so chains like x := i - 1;
+    # x := x * n leave the loop too. Inner loops go first, what they hoist can then leave the loops around them. The
+    # expressions have no side effects, so computing them when the loop doesn't run at all is safe.
+    result = []
+    for command in commands:
+        for block in nested_blocks(command):
+            hoist_invariants(block, symbols)
+        if command[0] in ("while", "until", "forup", "fordown"):
+            written = written_identifiers([command], set())
+            preheader = []
+            hoist_block(nested_blocks(command)[0], written, preheader, symbols)
+            result += [symbols.lines.derive(command, assignment) for assignment in preheader]
+        result.append(command)
+    commands[:] = result
+
+
+def hoist_block(commands, written, preheader, symbols):
+    # The body of a loop runs whole on every iteration only in the blocks of its graph that dominate its end, which
+    # are gone through down the dominator tree. Before a block on the way, the variables the blocks left aside could
+    # assign (the branches of an IF, the body of a WHILE) are forgotten, and so are the ones assigned anywhere in the
+    # inner loop the block starts, if any. forms maps the variables known to hold a value that doesn't change in the
+    # loop to that value, or to the expression computing it. hoisted maps the expressions computed before the loop to
+    # the variables holding them.
+    graph = cfg.Graph(commands)
+    tree = graph.dominator_tree()
+    path = [1]
+    while path[-1] != 0:
+        path.append(graph.idom[path[-1]])
+    on_path = set(path)
+    forms, hoisted, replaced = {}, {}, {}
+    for number in reversed(path):
+        inner = graph.loop(number)
+        if inner is not None:
+            forget(forms, graph.defines(inner))
+        for node in graph.blocks[number].nodes:
+            command = node.command
+            if type(node) != cfg.Assign:
+                forget(forms, node.defines)
+                continue
+            target, value = command[1], invariant_value(command[2], forms, written)
+            if value is not None and value[0] not in ("const", "load"):
+                if expensive(value):
+                    value = "load", materialize(value, preheader, hoisted, symbols)
+                    replaced[id(command)] = symbols.lines.derive(command, ("assign", target, value) + command[3:])
+                elif any(operand[0] not in ("const", "load") for operand in value[1:]):
+                    value = None
+            if type(target) == str:
+                if value is None:
+                    forms.pop(target, None)
+                else:
+                    forms[target] = value
+        aside = [child for child in tree[number] if child not in on_path]
+        while aside:
+            child = aside.pop()
+            forget(forms, graph.defines([child]))
+            aside += tree[child]
+    if replaced:
+        replace_commands(commands, replaced)
+
+
+def replace_commands(commands, replaced):
+    # Puts the commands in replaced (by id) in place of the ones they replace.
+    for i, command in enumerate(commands):
+        commands[i] = replaced.get(id(command), command)
+        for block in nested_blocks(commands[i]):
+            replace_commands(block, replaced)
+
+
+def invariant_value(value, forms, written):
+    # The value (or expression) in terms of what doesn't change in the loop, None if it changes.
+    if value[0] == "const":
+        return value
+    elif value[0] == "load":
+        ident = value[1]
+        if type(ident) == str and ident in forms:
+            return forms[ident]
+        elif ident in written or type(ident) == tuple and ident[0] == "array" and (
+                ident[1] in written or type(ident[2]) == tuple and ident[2][1] in written):
+            return None
+        return value
+    operands = tuple(invariant_value(operand, forms, written) for operand in value[1:])
+    return None if None in operands else (value[0],) + operands
+
+
+def expensive(expression):
+    # Whether computing the expression costs more than loading a variable: multiplications of two variables and
+    # divisions other than by a power of two, which are loops.
+    if expression[0] == "mul":
+        return expression[1][0] != "const" and expression[2][0] != "const"
+    elif expression[0] in ("div", "mod"):
+        return expression[2][0] != "const" or expression[2][1] & (expression[2][1] - 1) != 0
+    return False
+
+
+def materialize(expression, preheader, hoisted, symbols):
+    # Computes the expression before the loop (once), returns the variable holding it.
+    expression = (expression[0],) + tuple(operand if operand[0] in ("const", "load") else
+                                          ("load", materialize(operand, preheader, hoisted, symbols))
+                                          for operand in expression[1:])
+    if expression not in hoisted:
+        hoisted[expression] = symbols.add_temporary()
+        preheader.append(("assign", hoisted[expression], expression))
+    return hoisted[expression]
+
+
+def written_identifiers(commands, written):
+    # Variables, arrays and iterators the commands write.
+    for command in commands:
+        if command[0] in ("assign", "read"):
+            target = command[1]
+            written.add(target[1] if type(target) == tuple and target[0] == "array" else target)
+            written.update(command[3:])
+        elif command[0] in ("forup", "fordown"):
+            written.add(("undeclared", command[1]))
+        for block in nested_blocks(command):
+            written_identifiers(block, written)
+    return written
+
+
+def eliminate_dead_code(commands, symbols):
+    # Drops the commands after loops that never end and the assignments to variables (and elements of arrays) whose
+    # values are never read afterwards, then forgets the variables and arrays the program doesn't use anymore, so
+    # that they take no memory.
+    # Assignments reading something the code generator would report an error about stay. So does the first one to a
+    # variable in the program text if dropping it would leave a read of the variable before any assignment to it
+    # there, which is what the code generator checks.
+    completes(commands)
+    first_writes, unsafe = {}, set()
+    check_order(commands, set(), [], first_writes, unsafe, symbols)
+    graph = cfg.Graph(commands)
+    uninitialized = uninitialized_reads(commands, set(), set(), set())
+    kept = set()
+    while True:
+        dead = dead_assignments(graph, unsafe | kept, symbols)
+        broken = uninitialized_reads(commands, dead, set(), set()) - uninitialized
+        if not broken:
+            break
+        kept |= {first_writes[name] for name in broken}
+    remove_commands(commands, dead)
+    nodes = [node for block in graph.blocks for node in block.nodes if id(node.command) not in dead]
+    symbols.remove_unused(set().union(*(node.uses | node.defines for node in nodes)))
+
+
+def dead_assignments(graph, kept, symbols):
+    # The ids of the assignments to variables and arrays that aren't live afterwards, except the kept ones.
+    dead = set()
+    while True:
+        # Dropping assignments can make the values they read dead too.
+        live_out = graph.liveness(dead)
+        found = set()
+        for block in graph.order:
+            live = live_out[block.number]
+            for node in reversed(block.nodes):
+                command = node.command
+                if id(command) in dead:
+                    continue
+                target = command[1]
+                if type(node) == cfg.Assign and len(command) == 3 and id(command) not in kept and \
+                        cfg.target_key(target) not in live and (type(symbols.get(target)) == Variable or
+                                                                type(target) == tuple and target[0] == "array"):
+                    found.add(id(command))
+                    continue
+                live = live - node.kills | node.uses
+        if not found:
+            return dead
+        dead |= found
+
+
+def completes(commands):
+    # Drops the commands that can't be reached because a loop before them never ends, returns whether the commands
+    # can end.
+    for i, command in enumerate(commands):
+        ends = [completes(block) for block in nested_blocks(command)]
+        if command[0] == "ifelse":
+            ends = any(ends)
+        elif command[0] == "while":
+            ends = decide(command[1]) is not True
+        elif command[0] == "until":
+            ends = all(ends) and decide(command[1]) is not False
+        else:
+            ends = True
+        if not ends:
+            del commands[i + 1:]
+            return False
+    return True
+
+
+def check_order(commands, initialized, active, first_writes, unsafe, symbols):
+    # Goes through the commands in the order of the program text, like the code generator does, and finds (by id)
+    # the first assignments to the variables and the assignments reading something that isn't there yet.
+    for command in commands:
+        kind = command[0]
+        if kind == "assign" and not (safe(command[2], initialized, active, symbols) and (
+                type(command[1]) == str or safe(("load", command[1]), initialized, active, symbols))):
+            unsafe.add(id(command))
+        if kind in ("assign", "read") and type(command[1]) == str and command[1] not in initialized:
+            first_writes[command[1]] = id(command)
+            initialized.add(command[1])
+        if kind in ("forup", "fordown"):
+            active.append(command[1])
+            check_order(command[4], initialized, active, first_writes, unsafe, symbols)
+            active.pop()
+        else:
+            for block in nested_blocks(command):
+                check_order(block, initialized, active, first_writes, unsafe, symbols)
+
+
+def uninitialized_reads(commands, removed, initialized, names):
+    # The names read before any assignment to them in the order of the program text, leaving out the removed
+    # commands - the way the code generator goes through them: the condition of REPEAT comes after its body, and
+    # neither the conditions it decides (see simplify_condition) nor the blocks it generates no code for count.
+    for command in commands:
+        if id(command) in removed:
+            continue
+        kind = command[0]
+        blocks = nested_blocks(command)
+        if kind == "until":
+            uninitialized_reads(command[2], removed, initialized, names)
+            blocks = []
+        if kind in ("assign", "read"):
+            read = cfg.index_keys(command[1])
+            if kind == "assign":
+                cfg.value_keys(command[2], read)
+        elif kind in ("forup", "fordown"):
+            if command[2][0] == command[3][0] == "const" and (command[2][1] > command[3][1] if kind == "forup" else
+                                                              command[2][1] < command[3][1]):
+                continue
+            read = cfg.value_keys(command[3], cfg.value_keys(command[2], set()))
+        elif kind in ("if", "ifelse", "while") and type(simplify_condition(command[1])) == bool:
+            read = set()
+            blocks = [command[2]] if simplify_condition(command[1]) else command[3:4] if kind == "ifelse" else []
+        else:
+            read = cfg.value_keys(command[1], set())
+        names.update(name for name in read if type(name) == str and name not in initialized)
+        if kind in ("assign", "read") and type(command[1]) == str:
+            initialized.add(command[1])
+        for block in blocks:
+            uninitialized_reads(block, removed, initialized, names)
+    return names
+
+
+def uninitialized_variables(commands, symbols):
+    # The variables the code generator would find read before any assignment to them, leaving out the ones already
+    # marked as initialized.
+    initialized = {name for name, symbol in symbols.items() if type(symbol) == Variable and symbol.initialized}
+    return {name for name in uninitialized_reads(commands, set(), initialized, set())
+            if type(symbols.get(name)) == Variable}
+
+
+def safe(value, initialized, active, symbols):
+    # Whether the code generator can read the value without an error.
+    if value[0] == "const":
+        return True
+    elif value[0] == "load":
+        ident = value[1]
+        if type(ident) == str:
+            return type(symbols.get(ident)) == Variable and ident in initialized
+        elif ident[0] == "undeclared":
+            return ident[1] in active
+        elif type(ident[2]) == int:
+            return symbols[ident[1]].first_index <= ident[2] <= symbols[ident[1]].last_index
+        return safe(ident[2], initialized, active, symbols)
+    return all(safe(operand, initialized, active, symbols) for operand in value[1:])
+
+
+def remove_commands(commands, removed):
+    commands[:] = [command for command in commands if id(command) not in removed]
+    for command in commands:
+        for block in nested_blocks(command):
+            remove_commands(block, removed)
+
+
+def fuse_divisions(commands, symbols):
+    # q := a / b followed by r := a % b (or the other way round) in the same straight piece of code, with neither a
+    # nor b written in between, runs the division once: the first assignment also stores the other result in a new
+    # variable, which the second one just reads. Such assignments get the name of that variable as the fourth item.
+    for i, command in enumerate(commands):
+        for block in nested_blocks(command):
+            fuse_divisions(block, symbols)
+        if not divisible(command, symbols) or any(reads(value, command[1]) for value in command[2][1:]):
+            continue
+        expression = command[2]
+        other = "mod" if expression[0] == "div" else "div"
+        for j in range(i + 1, len(commands)):
+            later = commands[j]
+            if later[0] == "assign" and later[2] == (other,) + expression[1:] and len(later) == 3:
+                name = symbols.add_temporary()
+                commands[i] = symbols.lines.derive(command, command + (name,))
+                commands[j] = symbols.lines.derive(later, ("assign", later[1], ("load", name)))
+                break
+            if later[0] != "write" and (later[0] != "assign" or any(reads(value, later[1])
+                                                                    for value in expression[1:])):
+                break
+
+
+def divisible(command, symbols):
+    # Whether the command is an assignment of a division worth sharing with the matching modulo.
+    if command[0] != "assign" or len(command) > 3 or command[2][0] not in ("div", "mod"):
+        return False
+    target, (_, dividend, divisor) = command[1], command[2]
+    if type(target) == str and type(symbols.get(target)) != Variable or type(target) == tuple and \
+            target[0] == "undeclared":
+        return False
+    if dividend == divisor or dividend[0] == "const" and (divisor[0] == "const" or dividend[1] == 0):
+        return False
+    return divisor[0] != "const" or divisor[1] & (divisor[1] - 1) != 0